@@ -0,0 +1,321 @@
+"""ASGI entry point: async chat, upload and history endpoints in front of the Flask app.
+
+Run with a single process so every request shares one copy of the model:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+Upstream LLM calls are awaited on the event loop through httpx, while the
+synchronous Firestore, SQLAlchemy and embedding work runs in the thread
+pool. Uploads are handed to the background upload job queue, and their
+progress is pushed over Server-Sent Events, which only an event loop can hold
+open cheaply. All other routes (pages, login, admin) are served by the
+Flask app mounted underneath.
+"""
+import asyncio
+import time
+
+from itsdangerous import BadSignature
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+from llm_client import LLMError
+from response_cache import make_key
+from upload_jobs import FINISHED_STATUSES
+from merged_app import (
+    AI_UNAVAILABLE_MESSAGE,
+    UPLOAD_JOB_TIMEOUT,
+    app as flask_app,
+    build_ai_payload,
+    finish_chat_turn,
+    format_response,
+    get_fallback_match,
+    get_session_context,
+    get_session_history,
+    init_db,
+    list_chat_sessions,
+    llm_client,
+    llm_flights,
+    load_data,
+    resolve_chat_message,
+    response_cache,
+    sse_event,
+    start_upload_job,
+    upload_jobs,
+    with_document_context,
+)
+
+
+def _in_app_context(fn, *args):
+    with flask_app.app_context():
+        return fn(*args)
+
+
+async def run_sync(fn, *args):
+    """Run blocking application code in the thread pool inside a Flask app context."""
+    return await run_in_threadpool(_in_app_context, fn, *args)
+
+
+def flask_session(request):
+    """Decode the signed Flask session cookie set by the WSGI routes."""
+    cookie = request.cookies.get(flask_app.config["SESSION_COOKIE_NAME"])
+    if not cookie:
+        return {}
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    try:
+        return serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return {}
+
+
+async def _acomplete_ai_payload(data):
+    response_data = await llm_client.acomplete(data)
+    choices = response_data.get("choices", [])
+    if choices and "message" in choices[0] and "content" in choices[0]["message"]:
+        answer = format_response(choices[0]["message"]["content"])
+        response_cache.set(data, answer)
+        return answer
+    return "AI response not available."
+
+
+async def get_ai_response_async(user_message, chat_history, session_key=None):
+    """Async counterpart of merged_app.get_ai_response."""
+    # Building the payload may summarize older turns through the sync client
+    data = await run_sync(build_ai_payload, user_message, chat_history, session_key)
+    cached = response_cache.get(data)
+    if cached is not None:
+        return cached
+
+    key = make_key(data)
+    call, leader = llm_flights.join(key)
+    try:
+        if not leader:
+            return await call.wait_async(llm_flights.wait_timeout)
+        answer = error = None
+        try:
+            answer = await _acomplete_ai_payload(data)
+            return answer
+        except asyncio.CancelledError:
+            # This client went away; the requests waiting on it fall back instead of being cancelled too
+            error = LLMError("single-flight leader was cancelled")
+            raise
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            llm_flights.finish(key, call, result=answer, error=error)
+    except (LLMError, TimeoutError) as e:
+        print(f"AI request failed: {e}")
+        return AI_UNAVAILABLE_MESSAGE
+
+
+async def stream_ai_response_async(user_message, chat_history, session_key=None):
+    """Async counterpart of merged_app.stream_ai_response."""
+    data = await run_sync(build_ai_payload, user_message, chat_history, session_key)
+    cached = response_cache.get(data)
+    if cached is not None:
+        yield cached
+        return
+
+    key = make_key(data)
+    call, leader = llm_flights.join(key)
+    if not leader:
+        try:
+            answer = await call.wait_async(llm_flights.wait_timeout)
+        except (LLMError, TimeoutError) as e:
+            print(f"AI stream failed: {e}")
+            return
+        if answer:
+            yield answer
+        return
+
+    parts = []
+    answer = None
+    try:
+        async for token in llm_client.astream(data):
+            parts.append(token)
+            yield token
+        if parts:
+            answer = format_response("".join(parts))
+            response_cache.set(data, answer)
+    except LLMError as e:
+        print(f"AI stream failed: {e}")
+    finally:
+        llm_flights.finish(key, call, result=answer)
+
+
+async def _read_chat_request(request):
+    """Shared validation for the chat endpoints; returns (context, error_response)."""
+    user = flask_session(request)
+    if "user_id" not in user:
+        return None, JSONResponse({"error": "Unauthorized"}, status_code=401)
+
+    data = await request.json()
+    user_message = (data.get("message") or "").strip()
+    session_id = user.get("current_session")
+
+    if not user_message:
+        return None, JSONResponse({"response": "No message received!"})
+    if not session_id:
+        return None, JSONResponse({"error": "No active chat session"}, status_code=400)
+
+    current_history = await run_sync(get_session_context, user["user_id"], session_id)
+    stored_data = await run_sync(load_data)
+    matched_query, document_context = await run_sync(
+        resolve_chat_message, user["user_id"], session_id, user_message, stored_data
+    )
+    return (user["user_id"], session_id, user_message, current_history, stored_data, matched_query, document_context), None
+
+
+async def chat(request):
+    context, error = await _read_chat_request(request)
+    if error:
+        return error
+    user_id, session_id, user_message, current_history, stored_data, matched_query, document_context = context
+
+    if matched_query:
+        response = format_response(matched_query["answer"])
+    else:
+        response = await get_ai_response_async(
+            with_document_context(user_message, document_context),
+            current_history,
+            session_key=(str(user_id), session_id)
+        )
+        if response == AI_UNAVAILABLE_MESSAGE:
+            matched_query = await run_sync(get_fallback_match, user_message, stored_data)
+            if matched_query:
+                response = format_response(matched_query["answer"])
+
+    await run_sync(finish_chat_turn, user_id, session_id, user_message, response, matched_query, not document_context)
+    return JSONResponse({"response": response})
+
+
+async def chat_stream(request):
+    context, error = await _read_chat_request(request)
+    if error:
+        return error
+    user_id, session_id, user_message, current_history, stored_data, matched_query, document_context = context
+
+    async def generate():
+        nonlocal matched_query
+        if matched_query:
+            response = format_response(matched_query["answer"])
+            yield sse_event({"token": response})
+        else:
+            parts = []
+            prompt = with_document_context(user_message, document_context)
+            async for token in stream_ai_response_async(prompt, current_history, session_key=(str(user_id), session_id)):
+                parts.append(token)
+                yield sse_event({"token": token})
+            response = format_response("".join(parts)) if parts else AI_UNAVAILABLE_MESSAGE
+            if not parts:
+                matched_query = await run_sync(get_fallback_match, user_message, stored_data)
+                if matched_query:
+                    response = format_response(matched_query["answer"])
+
+        await run_sync(finish_chat_turn, user_id, session_id, user_message, response, matched_query, not document_context)
+        yield sse_event({"response": response}, event="done")
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def chat_sessions(request):
+    user = flask_session(request)
+    if "user_id" not in user:
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    return JSONResponse({"sessions": await run_sync(list_chat_sessions, user["user_id"])})
+
+
+async def chat_history(request):
+    user = flask_session(request)
+    if "user_id" not in user:
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+
+    session_id = request.query_params.get("session_id")
+    if not session_id:
+        return JSONResponse({"error": "Session ID is required"}, status_code=400)
+    return JSONResponse({"history": await run_sync(get_session_history, user["user_id"], session_id)})
+
+
+async def upload(request):
+    user = flask_session(request)
+    if "user_id" not in user:
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+
+    form = await request.form()
+    upload_file = form.get("file")
+    if upload_file is None or isinstance(upload_file, str):
+        return JSONResponse({"error": "No file uploaded!"}, status_code=400)
+    if not upload_file.filename:
+        return JSONResponse({"error": "No selected file!"}, status_code=400)
+
+    instructions = form.get("instructions", "Analyze this document and summarize the key points.")
+    data = await upload_file.read()
+    await upload_file.close()
+
+    payload, status = await run_sync(
+        start_upload_job,
+        user["user_id"],
+        user.get("current_session"),
+        upload_file.filename,
+        data,
+        instructions
+    )
+    if "job_id" in payload:
+        payload["events_url"] = f"/api/upload/{payload['job_id']}/events"
+    return JSONResponse(payload, status_code=status)
+
+
+async def upload_events(request):
+    """Server-Sent Events stream of an upload job's status changes and extraction progress."""
+    user = flask_session(request)
+    if "user_id" not in user:
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+
+    user_id, job_id = user["user_id"], request.path_params["job_id"]
+    await run_sync(init_db)
+    if not await run_sync(upload_jobs.get, job_id, user_id):
+        return JSONResponse({"error": "Upload job not found"}, status_code=404)
+
+    async def generate():
+        last_status = None
+        pages_done = 0
+        deadline = time.monotonic() + UPLOAD_JOB_TIMEOUT
+        while time.monotonic() < deadline:
+            job = await run_sync(upload_jobs.get, job_id, user_id)
+            if job["pages_done"] != pages_done:
+                pages_done = job["pages_done"]
+                yield sse_event({"pages_done": pages_done}, event="progress")
+            if job["status"] != last_status:
+                last_status = job["status"]
+                yield sse_event(job, event="status")
+            if job["status"] in FINISHED_STATUSES:
+                return
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+app = Starlette(routes=[
+    Route("/api/chat", chat, methods=["POST"]),
+    Route("/api/chat/stream", chat_stream, methods=["POST"]),
+    Route("/api/chat/sessions", chat_sessions, methods=["GET"]),
+    Route("/api/chat/history", chat_history, methods=["GET"]),
+    Route("/api/upload", upload, methods=["POST"]),
+    Route("/api/upload/{job_id}/events", upload_events, methods=["GET"]),
+    Mount("/", app=WSGIMiddleware(flask_app)),
+])
@@ -0,0 +1,225 @@
+"""Benchmark of the admin and history queries on a large sigce.db.
+
+Usage:
+
+    python benchmark_database.py [--chat-rows 2000000] [--login-rows 1000000] [--output results.json]
+
+A throwaway database with the pre-index schema is filled with synthetic
+users, login logs, chat history and upload jobs. The queries the app
+issues are then timed three ways: as an existing sigce.db runs them
+(rollback journal, no indexes), after `db_migrations.upgrade` and the
+connection pragmas, and again while a writer thread keeps inserting chat
+turns. The report gives p50/p95 latency per query and the SQLite plan used.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import create_engine, text
+
+from db_migrations import configure_sqlite, upgrade
+
+# The tables as create_all built them before the indexes were added
+LEGACY_SCHEMA = [
+    """CREATE TABLE user (
+        id INTEGER NOT NULL PRIMARY KEY, name VARCHAR(100) NOT NULL, email VARCHAR(100) NOT NULL UNIQUE,
+        phone VARCHAR(15) NOT NULL, password VARCHAR(200) NOT NULL, is_admin BOOLEAN,
+        registered_at DATETIME, last_login DATETIME)""",
+    """CREATE TABLE chat_history (
+        id INTEGER NOT NULL PRIMARY KEY, user_id INTEGER REFERENCES user (id), timestamp DATETIME,
+        user_message VARCHAR(500), bot_response VARCHAR(500), intent VARCHAR(50), session_id VARCHAR(50))""",
+    """CREATE TABLE upload_job (
+        id VARCHAR(36) NOT NULL PRIMARY KEY, user_id INTEGER REFERENCES user (id), session_id VARCHAR(50),
+        filename VARCHAR(255), instructions TEXT, status VARCHAR(20), extracted_text TEXT,
+        ai_response TEXT, error VARCHAR(500), created_at DATETIME, updated_at DATETIME)""",
+    """CREATE TABLE login_log (
+        id INTEGER NOT NULL PRIMARY KEY, user_id INTEGER REFERENCES user (id), timestamp DATETIME,
+        ip_address VARCHAR(50), success BOOLEAN)"""
+]
+
+# The statements SQLAlchemy emits for the app's queries
+QUERIES = {
+    "admin_login_logs": (
+        "SELECT user.email, login_log.timestamp, login_log.success, login_log.ip_address "
+        "FROM user JOIN login_log ON user.id = login_log.user_id "
+        "ORDER BY login_log.timestamp DESC LIMIT 50"
+    ),
+    "user_login_history": (
+        "SELECT timestamp, success, ip_address FROM login_log WHERE user_id = :user_id "
+        "ORDER BY timestamp DESC LIMIT 20"
+    ),
+    "session_history": (
+        "SELECT timestamp, user_message, bot_response FROM chat_history "
+        "WHERE user_id = :user_id AND session_id = :session_id ORDER BY timestamp"
+    ),
+    "user_sessions": (
+        "SELECT session_id, MAX(timestamp) AS last_message FROM chat_history WHERE user_id = :user_id "
+        "GROUP BY session_id ORDER BY last_message DESC"
+    ),
+    "active_upload_jobs": (
+        "SELECT count(*) FROM upload_job WHERE user_id = :user_id "
+        "AND status IN ('queued', 'extracting', 'analyzing') AND created_at >= :cutoff"
+    )
+}
+
+START = datetime(2024, 1, 1)
+
+
+def _stamp(seconds):
+    return (START + timedelta(seconds=seconds)).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def populate(engine, users, chat_rows, login_rows, upload_rows, sessions_per_user, rng, batch=50000):
+    span = 3600 * 24 * 365
+    with engine.begin() as connection:
+        for statement in LEGACY_SCHEMA:
+            connection.exec_driver_sql(statement)
+        connection.exec_driver_sql(
+            "INSERT INTO user (id, name, email, phone, password, is_admin, registered_at) VALUES (?, ?, ?, ?, ?, 0, ?)",
+            [(i, f"User {i}", f"user{i}@example.com", f"+91900000{i:04d}", "x", _stamp(i)) for i in range(1, users + 1)]
+        )
+
+    def fill(sql, count, row):
+        done = 0
+        while done < count:
+            size = min(batch, count - done)
+            with engine.begin() as connection:
+                connection.exec_driver_sql(sql, [row(done + i) for i in range(size)])
+            done += size
+
+    fill("INSERT INTO login_log (user_id, timestamp, ip_address, success) VALUES (?, ?, ?, ?)", login_rows,
+         lambda n: (rng.randint(1, users), _stamp(rng.randrange(span)), f"10.0.{n % 256}.{n % 199}", n % 7 != 0))
+    fill("INSERT INTO chat_history (user_id, timestamp, user_message, bot_response, intent, session_id) "
+         "VALUES (?, ?, ?, ?, ?, ?)", chat_rows,
+         lambda n: (rng.randint(1, users), _stamp(rng.randrange(span)), f"question {n}", f"answer {n}", "general",
+                    f"session-{rng.randrange(sessions_per_user)}"))
+    fill("INSERT INTO upload_job (id, user_id, session_id, filename, status, created_at, updated_at) "
+         "VALUES (?, ?, ?, ?, ?, ?, ?)", upload_rows,
+         lambda n: (f"job-{n}", rng.randint(1, users), "session-0", f"file{n}.pdf",
+                    rng.choice(("completed", "failed", "queued")), _stamp(rng.randrange(span)),
+                    _stamp(rng.randrange(span))))
+
+
+def query_plan(connection, sql, params):
+    rows = connection.execute(text("EXPLAIN QUERY PLAN " + sql), params).fetchall()
+    return [row[-1] for row in rows]
+
+
+def time_queries(engine, users, sessions_per_user, repeats, rng, max_seconds):
+    report = {}
+    with engine.connect() as connection:
+        for name, sql in QUERIES.items():
+            latencies = []
+            plan = None
+            deadline = time.perf_counter() + max_seconds
+            for _ in range(repeats):
+                params = {
+                    "user_id": rng.randint(1, users),
+                    "session_id": f"session-{rng.randrange(sessions_per_user)}",
+                    "cutoff": _stamp(3600 * 24 * 300)
+                }
+                if plan is None:
+                    plan = query_plan(connection, sql, params)
+                started = time.perf_counter()
+                connection.execute(text(sql), params).fetchall()
+                latencies.append((time.perf_counter() - started) * 1000)
+                if time.perf_counter() > deadline:
+                    break
+            values = np.asarray(latencies)
+            report[name] = {
+                "runs": len(latencies),
+                "p50_ms": float(np.percentile(values, 50)),
+                "p95_ms": float(np.percentile(values, 95)),
+                "plan": plan
+            }
+    return report
+
+
+def with_writer(engine, users, measure):
+    """Run `measure()` while another connection inserts chat turns in small transactions."""
+    stop = threading.Event()
+    written = [0]
+
+    def write():
+        n = 0
+        while not stop.is_set():
+            with engine.begin() as connection:
+                connection.exec_driver_sql(
+                    "INSERT INTO chat_history (user_id, timestamp, user_message, bot_response, intent, session_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(1 + (n + i) % users, _stamp(n + i), "q", "a", "general", "session-0") for i in range(20)]
+                )
+            n += 20
+            written[0] = n
+
+    writer = threading.Thread(target=write, daemon=True)
+    writer.start()
+    try:
+        result = measure()
+    finally:
+        stop.set()
+        writer.join()
+    return result, written[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite admin/history query benchmark")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--chat-rows", type=int, default=2000000)
+    parser.add_argument("--login-rows", type=int, default=1000000)
+    parser.add_argument("--upload-rows", type=int, default=100000)
+    parser.add_argument("--sessions-per-user", type=int, default=20)
+    parser.add_argument("--repeats", type=int, default=200)
+    parser.add_argument("--max-seconds", type=float, default=20.0, help="time limit per query and phase")
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, "sigce.db")
+        legacy = create_engine(f"sqlite:///{path}")
+        started = time.perf_counter()
+        populate(legacy, args.users, args.chat_rows, args.login_rows, args.upload_rows, args.sessions_per_user, rng)
+        print(f"Populated in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+        report = {
+            "rows": {"chat_history": args.chat_rows, "login_log": args.login_rows, "upload_job": args.upload_rows},
+            "before": time_queries(legacy, args.users, args.sessions_per_user, args.repeats, rng, args.max_seconds)
+        }
+        legacy.dispose()
+
+        engine = create_engine(f"sqlite:///{path}")
+        configure_sqlite(engine)
+        started = time.perf_counter()
+        upgrade(engine, log=lambda message: print(message, file=sys.stderr))
+        report["migration_seconds"] = time.perf_counter() - started
+        report["after"] = time_queries(engine, args.users, args.sessions_per_user, args.repeats, rng, args.max_seconds)
+        report["during_writes"], report["rows_written_during_reads"] = with_writer(
+            engine, args.users,
+            lambda: time_queries(engine, args.users, args.sessions_per_user, args.repeats, rng, args.max_seconds)
+        )
+        engine.dispose()
+
+    for name in QUERIES:
+        print(f"{name:<20} before p50 {report['before'][name]['p50_ms']:9.2f} ms   "
+              f"after p50 {report['after'][name]['p50_ms']:7.3f} ms   "
+              f"with writer p95 {report['during_writes'][name]['p95_ms']:7.3f} ms", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+"""Offline benchmark and threshold tuning for knowledge base matching.
+
+Usage:
+
+    python benchmark_retrieval.py [--scales 0,10000,100000] [--modes semantic,routed,hybrid] [--output results.json]
+
+A labelled query set is generated from data.json: each question is
+rewritten several ways (keywords only, typos, synonyms, truncation, a
+conversational prefix), and as many off-topic questions are synthesized as
+negatives, so precision at a threshold is not dominated by the positives.
+The queries are replayed against the same retrieval stages the app uses:
+plain embedding search, category-routed search, and the hybrid BM25/fuzzy
+rerank. The report covers p50/p95/p99 latency, queries per second,
+recall@1 and recall@k, and the threshold that maximizes F1.
+
+Scales above zero pad the knowledge base with synthetic distractor entries
+(real questions with extra words, and embeddings jittered by --noise), so
+growth can be measured without encoding 100k texts. Results are printed as
+JSON, or written to --output for regression comparison.
+
+With --documents, plain-text files stand in for uploads: they are chunked
+like the session document index, queries are built from their sentences,
+and the knowledge base queries serve as negatives. The report gives the
+chunk similarity threshold that maximizes F1 (set DOCUMENT_MATCH_THRESHOLD
+to it) and how often the app's rule, documents only when their best chunk
+beats the knowledge base match, sends each kind of query to the right place.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from embedding_index import EmbeddingIndex, normalize_rows, question_hash
+from document_index import chunk_text
+from hybrid_search import STOPWORDS, HybridRetriever
+from intent_router import IntentRouter
+from knowledge_base import normalize_question
+from retrievers import create_retriever
+
+SYNONYMS = {
+    "fees": "cost", "fee": "charges", "college": "institute", "timings": "schedule",
+    "hostel": "accommodation", "placement": "job placement", "admission": "enrollment",
+    "courses": "programs", "available": "offered", "provide": "offer", "students": "pupils",
+    "apply": "register", "facilities": "amenities", "branches": "departments"
+}
+
+NEGATIVES = [
+    "What is the weather in Paris tomorrow?",
+    "Who won the football world cup in 2018?",
+    "How do I bake a chocolate cake?",
+    "Recommend a good science fiction movie",
+    "What is the capital of Australia?",
+    "How many legs does a spider have?",
+    "Translate good morning into Japanese",
+    "What is the price of bitcoin today?",
+    "Write a poem about the ocean",
+    "How do I change a flat tyre?",
+    "Who painted the Mona Lisa?",
+    "What is the boiling point of mercury?",
+    "Suggest a workout plan for beginners",
+    "How far is the moon from the earth?",
+    "What are the rules of chess castling?",
+    "Best way to learn the guitar at home",
+    "How do volcanoes form?",
+    "Tell me a joke about cats",
+    "Which phone has the best camera?",
+    "How do I renew my passport?",
+]
+
+# Off-topic subjects and question shapes that are combined into more negatives
+OFF_TOPIC_SUBJECTS = [
+    "a sourdough starter", "the stock market", "a used car", "the Roman empire", "black holes",
+    "a vegetable garden", "the offside rule", "a wedding speech", "jet lag", "a leaking tap",
+    "electric scooters", "the French revolution", "house plants", "a marathon", "cryptocurrency wallets",
+    "a road trip", "the northern lights", "a job interview at a bank", "vintage watches", "a birthday party",
+    "the immune system", "solar panels", "a podcast", "origami", "the tax return deadline",
+    "a cat that will not eat", "the Olympic games", "a noisy neighbour", "smartphone batteries", "climate change",
+    "a mortgage", "scuba diving", "the Great Wall of China", "a sore throat", "video game consoles",
+    "a mechanical keyboard", "the moon landing", "a dinner party menu", "meditation", "the price of gold",
+    "a broken washing machine", "dinosaurs", "a camping trip", "jazz music", "the World Cup final",
+    "a puppy", "knitting", "the Amazon rainforest", "a credit card bill", "sushi",
+    "a home gym", "the Eiffel Tower", "a flat tyre", "wine tasting", "hurricanes",
+    "an electric car", "a chess opening", "the Renaissance", "a hiking boot", "coffee beans",
+]
+OFF_TOPIC_TEMPLATES = [
+    "How do I get started with {}?", "What should I know about {}?", "Can you explain {} simply?",
+    "What are the pros and cons of {}?", "Give me some tips on {}", "Why is everyone talking about {}?",
+    "What is the history of {}?", "How much does {} usually cost?", "Is {} worth it?",
+    "tell me about {}", "{} explained", "best advice for {}",
+    "What are common mistakes with {}?", "Where can I read more about {}?", "I need help with {}",
+    "What do experts say about {}?", "How has {} changed over time?", "Any fun facts about {}?",
+    "Is {} safe?", "quick summary of {}",
+]
+
+
+def paraphrases(question, rng):
+    """Deterministic rewrites of a question, as (kind, text) pairs."""
+    words = question.rstrip("?").split()
+    lowered = normalize_question(question).split()
+    variants = [("keywords", " ".join(w for w in lowered if w not in STOPWORDS))]
+
+    candidates = [i for i, w in enumerate(words) if len(w) > 4]
+    if candidates:
+        i = rng.choice(candidates)
+        j = rng.randrange(len(words[i]) - 1)
+        typo = words[i][:j] + words[i][j + 1] + words[i][j] + words[i][j + 2:]
+        variants.append(("typo", " ".join(words[:i] + [typo] + words[i + 1:])))
+
+    swapped = [SYNONYMS.get(w.lower(), w) for w in words]
+    if swapped != words:
+        variants.append(("synonym", " ".join(swapped)))
+    if len(words) > 5:
+        variants.append(("truncated", " ".join(words[:max(3, int(len(words) * 0.6))])))
+    variants.append(("conversational", "can you tell me " + " ".join(lowered)))
+    return [(kind, text) for kind, text in variants if text.strip()]
+
+
+def off_topic_queries(count, rng):
+    """`count` distinct off-topic questions: the fixed NEGATIVES, then synthesized ones."""
+    synthesized = [template.format(subject) for subject in OFF_TOPIC_SUBJECTS for template in OFF_TOPIC_TEMPLATES]
+    rng.shuffle(synthesized)
+    return (NEGATIVES + synthesized)[:count]
+
+
+def build_queries(queries, rng, negatives=None):
+    """Labelled queries: (text, kind, label row or None).
+
+    `negatives` off-topic queries are added; by default as many as there are positives.
+    """
+    labelled = []
+    for row, entry in enumerate(queries):
+        for kind, text in paraphrases(entry["question"], rng):
+            labelled.append((text, kind, row))
+    count = len(labelled) if negatives is None else negatives
+    labelled.extend((text, "negative", None) for text in off_topic_queries(count, rng))
+    return labelled
+
+
+def synthetic_entries(queries, vectors, count, noise, rng):
+    """Distractor entries derived from real ones, with jittered embeddings."""
+    vocabulary = sorted({w for q in queries for w in normalize_question(q["question"]).split()})
+    np_rng = np.random.default_rng(rng.randrange(2 ** 32))
+    bases = np_rng.integers(0, len(queries), size=count)
+    extra = []
+    for n, base in enumerate(bases):
+        entry = queries[int(base)]
+        words = rng.sample(vocabulary, k=min(3, len(vocabulary)))
+        extra.append({
+            "question": f"{entry['question']} {' '.join(words)} {n}",
+            "answer": entry.get("answer", ""),
+            "category": entry.get("category")
+        })
+    jitter = np_rng.standard_normal((count, vectors.shape[1])).astype(np.float32) * (noise / np.sqrt(vectors.shape[1]))
+    return extra, normalize_rows(vectors[bases] + jitter)
+
+
+def build_index(questions, vectors, backend, work_dir):
+    """An EmbeddingIndex over precomputed vectors, without writing it to disk."""
+    index = EmbeddingIndex(os.path.join(work_dir, "benchmark_embeddings.npz"), "benchmark",
+                           retriever=create_retriever(backend))
+    index.hashes = [question_hash(q) for q in questions]
+    index.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index.retriever.build(index.vectors)
+    return index
+
+
+def percentiles(values_ms):
+    values = np.asarray(values_ms, dtype=np.float64)
+    return {
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99))
+    }
+
+
+def threshold_report(top1, thresholds):
+    """Precision/recall/F1 per threshold from (score, correct, is_positive) triples.
+
+    `rejected_negatives` is the share of negatives scored below the threshold,
+    which does not depend on how many positives there are.
+    """
+    positives = sum(1 for _, _, positive in top1 if positive)
+    negatives = len(top1) - positives
+    report = []
+    for threshold in thresholds:
+        accepted = [(correct, positive) for score, correct, positive in top1 if score >= threshold]
+        tp = sum(1 for correct, positive in accepted if correct and positive)
+        precision = tp / len(accepted) if accepted else 1.0
+        recall = tp / positives if positives else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        report.append({
+            "threshold": round(float(threshold), 2),
+            "precision": precision,
+            "recall": recall,
+            "f1": f1,
+            "rejected_negatives": 1 - sum(1 for _, positive in accepted if not positive) / negatives if negatives else 1.0,
+            "hit_rate": len(accepted) / len(top1) if top1 else 0.0
+        })
+    return report
+
+
+def run_mode(mode, labelled, query_vectors, queries, index, router, hybrid, k, current_threshold):
+    same_question = [normalize_question(q["question"]) for q in queries]
+    latencies, top1, recall_1, recall_k = [], [], 0, 0
+    positives = 0
+
+    for (text, _, label), vector in zip(labelled, query_vectors):
+        started = time.perf_counter()
+        if mode == "semantic":
+            results = index.top_k(vector, k)
+        else:
+            results = router.search(vector, k)
+            if mode == "hybrid":
+                results = hybrid.search(text, vector, k, semantic_candidates=results)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+        rows = [row for row, _ in results]
+        # Rows with the same normalized question (duplicates, synthetic copies excluded) count as hits
+        correct = [label is not None and row < len(same_question) and same_question[row] == same_question[label]
+                   for row in rows]
+        if label is not None:
+            positives += 1
+            recall_1 += bool(correct[:1] and correct[0])
+            recall_k += any(correct)
+        top1.append((results[0][1] if results else 0.0, bool(correct and correct[0]), label is not None))
+
+    sweep = threshold_report(top1, np.arange(0.30, 0.96, 0.01))
+    best = max(sweep, key=lambda item: item["f1"])
+    current = threshold_report(top1, [current_threshold])[0]
+    total_seconds = sum(latencies) / 1000
+    return {
+        "mode": mode,
+        "latency_ms": percentiles(latencies),
+        "qps": len(latencies) / total_seconds if total_seconds else 0.0,
+        "recall@1": recall_1 / positives if positives else 0.0,
+        f"recall@{k}": recall_k / positives if positives else 0.0,
+        "best_threshold": best,
+        "current_threshold": current
+    }
+
+
+def document_queries(chunks, rng, per_chunk=2):
+    """Labelled queries about document chunks: (text, kind, sentence) triples."""
+    labelled = []
+    for chunk in chunks:
+        sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+", chunk) if len(s.split()) >= 6]
+        for sentence in rng.sample(sentences, k=min(per_chunk, len(sentences))):
+            for kind, text in paraphrases(" ".join(sentence.split()[:14]), rng):
+                if kind in ("keywords", "conversational"):
+                    labelled.append((text, kind, sentence))
+    return labelled
+
+
+def run_documents(model, paths, labelled, query_vectors, index, rng):
+    """Chunk threshold and routing accuracy for document queries against knowledge base queries."""
+    chunks = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            chunks.extend(chunk_text(f.read()))
+    if not chunks:
+        return None
+    chunk_vectors = normalize_rows(model.encode(chunks, batch_size=64))
+    doc_labelled = document_queries(chunks, rng)
+    doc_vectors = normalize_rows(model.encode([text for text, _, _ in doc_labelled], batch_size=64))
+
+    def best_chunk(vector):
+        scores = chunk_vectors @ vector
+        best = int(np.argmax(scores))
+        return best, float(scores[best])
+
+    def best_entry(vector):
+        results = index.top_k(vector, 1)
+        return results[0][1] if results else 0.0
+
+    top1, doc_routed, kb_routed, kb_total = [], 0, 0, 0
+    for (_, _, sentence), vector in zip(doc_labelled, doc_vectors):
+        row, score = best_chunk(vector)
+        top1.append((score, sentence in chunks[row], True))
+        doc_routed += score > best_entry(vector)
+    for (_, _, label), vector in zip(labelled, query_vectors):
+        _, score = best_chunk(vector)
+        top1.append((score, False, False))
+        if label is not None:
+            kb_total += 1
+            kb_routed += best_entry(vector) >= score
+
+    sweep = threshold_report(top1, np.arange(0.10, 0.81, 0.01))
+    return {
+        "chunks": len(chunks),
+        "queries": {"document": len(doc_labelled), "knowledge_base": len(labelled)},
+        "document_threshold": max(sweep, key=lambda item: item["f1"]),
+        "documents_preferred": doc_routed / len(doc_labelled) if doc_labelled else 0.0,
+        "knowledge_base_preferred": kb_routed / kb_total if kb_total else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Knowledge base retrieval benchmark")
+    parser.add_argument("--data", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data.json"))
+    parser.add_argument("--model", default="all-mpnet-base-v2")
+    parser.add_argument("--retriever", default="exact", help="exact, faiss or hnswlib")
+    parser.add_argument("--modes", default="semantic,routed,hybrid")
+    parser.add_argument("--scales", default="0,10000,100000",
+                        help="comma-separated synthetic entry counts to add (0 = data.json only)")
+    parser.add_argument("--noise", type=float, default=0.6, help="embedding jitter of synthetic entries")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--semantic-threshold", type=float, default=0.7)
+    parser.add_argument("--hybrid-threshold", type=float, default=0.6)
+    parser.add_argument("--negatives", type=int,
+                        help="off-topic queries to add (default: as many as the positives)")
+    parser.add_argument("--documents", nargs="*", default=[],
+                        help="plain-text files to calibrate DOCUMENT_MATCH_THRESHOLD against")
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+
+    rng = random.Random(args.seed)
+    with open(args.data, "r", encoding="utf-8") as f:
+        queries = json.load(f).get("queries", [])
+    labelled = build_queries(queries, rng, args.negatives)
+
+    model = SentenceTransformer(args.model)
+    started = time.perf_counter()
+    real_vectors = normalize_rows(model.encode([q["question"] for q in queries], batch_size=64))
+    index_seconds = time.perf_counter() - started
+    query_vectors = normalize_rows(model.encode([text for text, _, _ in labelled], batch_size=64))
+    # The app encodes one message per request, so time single encodes on a sample
+    encode_ms = []
+    for text, _, _ in labelled[:50]:
+        started = time.perf_counter()
+        model.encode([text])
+        encode_ms.append((time.perf_counter() - started) * 1000)
+
+    report = {
+        "model": args.model,
+        "retriever": args.retriever,
+        "entries": len(queries),
+        "queries": {
+            "positive": sum(1 for _, _, label in labelled if label is not None),
+            "negative": sum(1 for _, _, label in labelled if label is None)
+        },
+        "index_build_seconds": index_seconds,
+        "encode_ms": percentiles(encode_ms),
+        "results": []
+    }
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for scale in (int(s) for s in args.scales.split(",") if s.strip()):
+            scaled_queries, scaled_vectors = queries, real_vectors
+            if scale:
+                extra, extra_vectors = synthetic_entries(queries, real_vectors, scale, args.noise, rng)
+                scaled_queries = queries + extra
+                scaled_vectors = np.vstack([real_vectors, extra_vectors])
+
+            index = build_index([q["question"] for q in scaled_queries], scaled_vectors, args.retriever, work_dir)
+            router, hybrid = IntentRouter(), HybridRetriever()
+            router.sync(scaled_queries, index)
+            hybrid.sync(scaled_queries, index)
+
+            for mode in (m.strip() for m in args.modes.split(",") if m.strip()):
+                threshold = args.hybrid_threshold if mode == "hybrid" else args.semantic_threshold
+                result = run_mode(mode, labelled, query_vectors, scaled_queries, index, router, hybrid,
+                                  args.k, threshold)
+                result["entries"] = len(scaled_queries)
+                report["results"].append(result)
+                print(f"{len(scaled_queries):>7} entries  {mode:<8} p50 {result['latency_ms']['p50']:.2f} ms  "
+                      f"recall@1 {result['recall@1']:.3f}  best threshold {result['best_threshold']['threshold']}  "
+                      f"at {threshold}: precision {result['current_threshold']['precision']:.3f} "
+                      f"recall {result['current_threshold']['recall']:.3f}",
+                      flush=True, file=sys.stderr)
+
+    if args.documents:
+        index = build_index([q["question"] for q in queries], real_vectors, args.retriever, tempfile.gettempdir())
+        report["documents"] = run_documents(model, args.documents, labelled, query_vectors, index, rng)
+        if report["documents"]:
+            print(f"documents  threshold {report['documents']['document_threshold']['threshold']}  "
+                  f"documents preferred {report['documents']['documents_preferred']:.3f}  "
+                  f"knowledge base preferred {report['documents']['knowledge_base_preferred']:.3f}",
+                  flush=True, file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""Firestore storage for chat sessions, one document per session and per message.
+
+Layout:
+
+    users/{user_id}/sessions/{session_id}
+        session_id, created_at, updated_at, preview, message_count, recent
+    users/{user_id}/sessions/{session_id}/messages/{ts}
+        role ('user' or 'bot'), content, ts, created_at
+
+Message document ids are zero-padded nanosecond timestamps, so they sort in
+conversation order and a turn only writes the new messages plus a small
+update to the session document. `recent` keeps the last few messages on the
+session document so a chat turn can get its context from one read.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+
+
+def message_doc_id(ts):
+    return f"{ts:020d}"
+
+
+def _to_history(messages):
+    return [{m.get('role', 'user'): m.get('content', '')} for m in messages]
+
+
+class ChatStore:
+    """Chat session reads and writes against the per-session subcollections.
+
+    Session documents are cached per process for `cache_ttl` seconds together
+    with their Firestore update_time. Writes are made conditional on that
+    update_time, so a stale cache entry makes the write fail and the turn
+    is retried against a fresh read rather than overwriting newer data.
+    """
+
+    def __init__(self, client, recent_limit=20, cache_ttl=30, cache_size=1024):
+        # A zero-argument callable defers connecting until the first read or write
+        self._client = client
+        self.recent_limit = recent_limit
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.reads = 0
+        self.cache_hits = 0
+        self.conflicts = 0
+
+    @property
+    def client(self):
+        return self._client() if callable(self._client) else self._client
+
+    def sessions_ref(self, user_id):
+        return self.client.collection('users').document(str(user_id)).collection('sessions')
+
+    def session_ref(self, user_id, session_id):
+        return self.sessions_ref(user_id).document(session_id)
+
+    def _cached(self, key):
+        with self._lock:
+            state = self._cache.get(key)
+            if state is None or state['expires'] < time.monotonic():
+                return None
+            self._cache.move_to_end(key)
+            return state
+
+    def _remember(self, key, state):
+        state['expires'] = time.monotonic() + self.cache_ttl
+        with self._lock:
+            self._cache[key] = state
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _forget(self, key):
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def load_session(self, user_id, session_id, use_cache=True):
+        """Session state (existence, preview, recent messages, update_time), cached briefly."""
+        key = (str(user_id), session_id)
+        if use_cache:
+            state = self._cached(key)
+            if state is not None:
+                self.cache_hits += 1
+                return state
+
+        self.reads += 1
+        snapshot = self.session_ref(user_id, session_id).get()
+        data = snapshot.to_dict() if snapshot.exists else {}
+        recent = data.get('recent')
+        if snapshot.exists and recent is None:
+            # Sessions written before `recent` existed: rebuild it from the messages once
+            recent = [{'role': role, 'content': content}
+                      for message in self.get_history(user_id, session_id, limit=self.recent_limit)
+                      for role, content in message.items()]
+        state = {
+            'exists': snapshot.exists,
+            'preview': data.get('preview'),
+            'recent': recent or [],
+            'update_time': snapshot.update_time if snapshot.exists else None,
+            'message_count': data.get('message_count') or 0
+        }
+        self._remember(key, state)
+        return state
+
+    def get_recent_history(self, user_id, session_id):
+        """The last `recent_limit` messages, served from the session cache when fresh."""
+        return _to_history(self.load_session(user_id, session_id)['recent'])
+
+    def stats(self):
+        return {
+            'session_reads': self.reads,
+            'session_cache_hits': self.cache_hits,
+            'write_conflicts': self.conflicts,
+            'cached_sessions': len(self._cache)
+        }
+
+    def create_session(self, user_id, session_id):
+        """Create an empty session document."""
+        now = datetime.utcnow().isoformat()
+        result = self.session_ref(user_id, session_id).set({
+            'session_id': session_id,
+            'created_at': now,
+            'updated_at': now,
+            'preview': None,
+            'message_count': 0,
+            'recent': []
+        })
+        self._remember((str(user_id), session_id), {
+            'exists': True,
+            'preview': None,
+            'recent': [],
+            'update_time': result.update_time,
+            'message_count': 0
+        })
+
+    def list_sessions(self, user_id):
+        """Session documents, newest first."""
+        query = self.sessions_ref(user_id).order_by('created_at', direction=firestore.Query.DESCENDING)
+        return [doc.to_dict() for doc in query.stream()]
+
+    def get_history(self, user_id, session_id, limit=None):
+        """Messages of one session in the legacy [{'user': ...}, {'bot': ...}] shape.
+
+        With `limit`, only the most recent messages are read.
+        """
+        messages = self.session_ref(user_id, session_id).collection('messages')
+        if limit:
+            docs = list(messages.order_by('ts', direction=firestore.Query.DESCENDING).limit(limit).stream())
+            docs.reverse()
+        else:
+            docs = messages.order_by('ts').stream()
+        return _to_history(doc.to_dict() for doc in docs)
+
+    def _merge_recent(self, recent, messages):
+        """Add `messages` not already present (by ts) and keep the newest `recent_limit`."""
+        seen = {m.get('ts') for m in recent}
+        missing = [m for m in messages if m['ts'] not in seen]
+        if missing:
+            recent = sorted(recent + missing, key=lambda m: m.get('ts', 0))
+        return recent[-self.recent_limit:]
+
+    def stage_turn(self, user_id, session_id, user_message, bot_response):
+        """Add a user/bot exchange to the cached session view and return its messages.
+
+        The messages are visible to `get_recent_history` straight away; they
+        reach Firestore when `write_messages` is called with them.
+        """
+        turn = [(role, content) for role, content in (('user', user_message), ('bot', bot_response)) if content]
+        base_ts = time.time_ns()
+        messages = [{'role': role, 'content': content, 'ts': base_ts + offset}
+                    for offset, (role, content) in enumerate(turn)]
+        if not messages:
+            return []
+
+        state = self.load_session(user_id, session_id)
+        with self._lock:
+            state['recent'] = self._merge_recent(state['recent'], messages)
+            if not state['preview'] and user_message:
+                state['preview'] = user_message
+        return messages
+
+    def write_messages(self, user_id, session_id, messages):
+        """Persist staged messages of one session in a single batch.
+
+        The session document write carries an update_time precondition from
+        the cached read; on conflict the cache is dropped and the batch is
+        rebuilt from a fresh read. The last attempt writes unconditionally so
+        the messages are never lost. Message ids come from the staged
+        timestamps, so a retried batch rewrites the same documents, and
+        `message_count` only grows by the messages whose documents do not
+        exist yet. That read is covered by the same precondition, since every
+        message write also updates the session document.
+        """
+        if not messages:
+            return
+
+        key = (str(user_id), session_id)
+        session_ref = self.session_ref(user_id, session_id)
+        attempts = 3
+        for attempt in range(attempts):
+            state = self.load_session(user_id, session_id, use_cache=(attempt == 0))
+            conditional = attempt < attempts - 1
+
+            message_refs = [session_ref.collection('messages').document(message_doc_id(m['ts'])) for m in messages]
+            stored = 0
+            if state['exists']:
+                stored = sum(1 for snapshot in self.client.get_all(message_refs) if snapshot.exists)
+
+            now = datetime.utcnow().isoformat()
+            batch = self.client.batch()
+            for ref, message in zip(message_refs, messages):
+                batch.set(ref, {**message, 'created_at': now})
+
+            with self._lock:
+                recent = self._merge_recent(state['recent'], messages)
+                preview = state['preview'] or next((m['content'] for m in messages if m['role'] == 'user'), None)
+                message_count = state.get('message_count', 0) + len(messages) - stored
+            fields = {
+                'updated_at': now,
+                'message_count': message_count,
+                'recent': recent,
+                'preview': preview
+            }
+            if not state['exists']:
+                fields.update(session_id=session_id, created_at=now)
+                if conditional:
+                    batch.create(session_ref, fields)
+                else:
+                    batch.set(session_ref, fields, merge=True)
+            elif conditional:
+                option = self.client.write_option(last_update_time=state['update_time'])
+                batch.update(session_ref, fields, option=option)
+            else:
+                batch.set(session_ref, fields, merge=True)
+
+            try:
+                results = batch.commit()
+            except (FailedPrecondition, AlreadyExists, NotFound):
+                self.conflicts += 1
+                self._forget(key)
+                continue
+
+            with self._lock:
+                # Other turns may have been staged on this state while the batch was in flight
+                state['recent'] = self._merge_recent(state['recent'], messages)
+                state['preview'] = state['preview'] or preview
+                state['exists'] = True
+                state['update_time'] = results[-1].update_time
+                state['message_count'] = message_count
+            self._remember(key, state)
+            return
+
+    def append_turn(self, user_id, session_id, user_message, bot_response):
+        """Stage and synchronously write one user/bot exchange."""
+        self.write_messages(user_id, session_id, self.stage_turn(user_id, session_id, user_message, bot_response))
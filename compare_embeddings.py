@@ -0,0 +1,178 @@
+"""Re-embed the knowledge base with another embedding backend and compare it to the current one.
+
+Usage:
+
+    python compare_embeddings.py --candidate-backend onnx --candidate-onnx-path models/mpnet-onnx
+    python compare_embeddings.py --candidate-backend onnx --candidate-onnx-path models/minilm-onnx --write-index
+
+Both encoders embed the same knowledge base and the labelled paraphrase and
+off-topic queries from benchmark_retrieval.py. The report gives, for each
+encoder, recall@1/recall@k, the F1-optimal threshold, single-query encode
+latency, batch throughput and the resident memory the model added, followed
+by the candidate-minus-reference deltas and how often both return the same
+top entry. A changed best threshold means SIMILARITY_THRESHOLD (and
+HYBRID_THRESHOLD) should be retuned before switching.
+
+--write-index saves the candidate's embeddings to the app's index file under
+the key the app will look for, so workers started with the new backend do
+not re-encode the knowledge base at startup.
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmark_retrieval import build_index, build_queries, percentiles, run_mode
+from embedding_backends import BACKENDS, encoder_key, load_encoder
+from embedding_index import EmbeddingIndex, normalize_rows
+from hybrid_search import HybridRetriever
+from intent_router import IntentRouter
+from knowledge_base import KnowledgeBase
+from retrievers import create_retriever
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def resident_mb():
+    """Current resident set size of this process, or None off Linux."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def evaluate(name, encoder_args, queries, labelled, k, threshold, hybrid_threshold):
+    """Load one encoder, embed everything with it and run the semantic and hybrid benchmarks."""
+    gc.collect()
+    before = resident_mb()
+    started = time.perf_counter()
+    encoder = load_encoder(**encoder_args)
+    load_seconds = time.perf_counter() - started
+    after = resident_mb()
+
+    questions = [q["question"] for q in queries]
+    started = time.perf_counter()
+    kb_vectors = normalize_rows(encoder.encode(questions, batch_size=64))
+    kb_seconds = time.perf_counter() - started
+    query_vectors = normalize_rows(encoder.encode([text for text, _, _ in labelled], batch_size=64))
+
+    encode_ms = []
+    for text, _, _ in labelled[:100]:
+        started = time.perf_counter()
+        encoder.encode([text])
+        encode_ms.append((time.perf_counter() - started) * 1000)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        index = build_index(questions, kb_vectors, "exact", work_dir)
+        router, hybrid = IntentRouter(), HybridRetriever()
+        router.sync(queries, index)
+        hybrid.sync(queries, index)
+        semantic = run_mode("semantic", labelled, query_vectors, queries, index, router, hybrid, k, threshold)
+        fused = run_mode("hybrid", labelled, query_vectors, queries, index, router, hybrid, k, hybrid_threshold)
+        top1 = [index.top_k(vector, 1)[0][0] if len(index) else None for vector in query_vectors]
+
+    report = {
+        "name": name,
+        "dimension": int(kb_vectors.shape[1]),
+        "load_seconds": load_seconds,
+        "resident_mb": (after - before) if before is not None and after is not None else None,
+        "encode_ms": percentiles(encode_ms),
+        "kb_encode_per_second": len(questions) / kb_seconds if kb_seconds else 0.0,
+        "semantic": semantic,
+        "hybrid": fused
+    }
+    return report, encoder, top1
+
+
+def delta(reference, candidate, k):
+    keys = ("recall@1", f"recall@{k}")
+    result = {}
+    for mode in ("semantic", "hybrid"):
+        ref, cand = reference[mode], candidate[mode]
+        result[mode] = {key: cand[key] - ref[key] for key in keys}
+        result[mode]["best_threshold"] = cand["best_threshold"]["threshold"] - ref["best_threshold"]["threshold"]
+        result[mode]["best_f1"] = cand["best_threshold"]["f1"] - ref["best_threshold"]["f1"]
+    result["encode_p50_speedup"] = (reference["encode_ms"]["p50"] / candidate["encode_ms"]["p50"]
+                                    if candidate["encode_ms"]["p50"] else None)
+    if reference["resident_mb"] and candidate["resident_mb"]:
+        result["resident_mb_ratio"] = candidate["resident_mb"] / reference["resident_mb"]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare an embedding backend against the current model")
+    parser.add_argument("--data", default=os.path.join(HERE, "data.json"))
+    parser.add_argument("--reference-backend", default="torch", choices=BACKENDS)
+    parser.add_argument("--reference-model", default="all-mpnet-base-v2")
+    parser.add_argument("--reference-onnx-path")
+    parser.add_argument("--candidate-backend", default="onnx", choices=BACKENDS)
+    parser.add_argument("--candidate-model", default="all-mpnet-base-v2",
+                        help="model name the candidate was exported from (used for the index key)")
+    parser.add_argument("--candidate-onnx-path")
+    parser.add_argument("--no-quantized", action="store_true", help="use the float ONNX model, not the int8 one")
+    parser.add_argument("--threads", type=int, help="ONNX Runtime intra-op threads")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--semantic-threshold", type=float, default=0.7)
+    parser.add_argument("--hybrid-threshold", type=float, default=0.6)
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--write-index", action="store_true",
+                        help="save the candidate's knowledge base embeddings for the app")
+    parser.add_argument("--index-path", default=os.path.join(HERE, "data_embeddings.npz"))
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    quantized = not args.no_quantized
+    snapshot = KnowledgeBase(args.data).snapshot()
+    queries = snapshot["queries"]
+    labelled = build_queries(queries, random.Random(args.seed))
+
+    # The candidate goes first so the reference model's memory is not counted against it
+    candidate_args = {"backend": args.candidate_backend, "model_name": args.candidate_model,
+                      "onnx_path": args.candidate_onnx_path, "quantized": quantized, "threads": args.threads}
+    candidate_key = encoder_key(args.candidate_backend, args.candidate_model, args.candidate_onnx_path, quantized)
+    candidate, encoder, candidate_top1 = evaluate(candidate_key, candidate_args, queries, labelled, args.k,
+                                                  args.semantic_threshold, args.hybrid_threshold)
+    if args.write_index:
+        index = EmbeddingIndex(args.index_path, candidate_key, retriever=create_retriever("exact"))
+        index.sync([q["question"] for q in queries], encoder.encode, version=snapshot.get("version"))
+        print(f"Wrote {len(index)} embeddings for {candidate_key} to {args.index_path}", file=sys.stderr)
+    del encoder
+
+    reference_args = {"backend": args.reference_backend, "model_name": args.reference_model,
+                      "onnx_path": args.reference_onnx_path, "threads": args.threads}
+    reference_key = encoder_key(args.reference_backend, args.reference_model, args.reference_onnx_path)
+    reference, _, reference_top1 = evaluate(reference_key, reference_args, queries, labelled, args.k,
+                                            args.semantic_threshold, args.hybrid_threshold)
+
+    report = {
+        "entries": len(queries),
+        "queries": len(labelled),
+        "reference": reference,
+        "candidate": candidate,
+        "delta": delta(reference, candidate, args.k),
+        "top1_agreement": float(np.mean([a == b for a, b in zip(reference_top1, candidate_top1)])) if labelled else 0.0
+    }
+    for side in ("reference", "candidate"):
+        result = report[side]
+        print(f"{result['name']:<32} recall@1 {result['semantic']['recall@1']:.3f}  "
+              f"best threshold {result['semantic']['best_threshold']['threshold']}  "
+              f"encode p50 {result['encode_ms']['p50']:.1f} ms", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Token-budgeted conversation history for LLM requests.
+
+Both user and bot turns are sent, newest first, until the token budget is
+spent. Turns that no longer fit are folded into a rolling summary that is
+cached per chat session, so a long conversation costs about the same per
+request as a short one. The stored history is only a window of the newest
+messages; ones that slide out of it before being summarized are carried
+until they are.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Chat-completions role for each role stored in chat history
+ROLES = {"user": "user", "bot": "assistant"}
+# Per-message formatting overhead of the chat template
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class TokenCounter:
+    """Counts tokens with tiktoken, or estimates four characters per token without it."""
+
+    def __init__(self, encoding_name="cl100k_base"):
+        self.encoding_name = encoding_name
+        self._encoding = None
+        self._unavailable = tiktoken is None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._encoding is None and not self._unavailable:
+            with self._lock:
+                if self._encoding is None and not self._unavailable:
+                    try:
+                        self._encoding = tiktoken.get_encoding(self.encoding_name)
+                    except Exception as e:
+                        # The BPE file is downloaded on first use and may be unreachable
+                        print(f"tiktoken unavailable, estimating token counts: {e}")
+                        self._unavailable = True
+        return self._encoding
+
+    def __call__(self, text):
+        encoding = self._load()
+        if encoding is None:
+            return max(1, len(text) // 4)
+        return len(encoding.encode(text, disallowed_special=()))
+
+
+def _fingerprint(message):
+    return hashlib.sha1(f"{message['role']}\x00{message['content']}".encode("utf-8")).hexdigest()
+
+
+def _dropped_count(previous, fingerprints):
+    """How many of the oldest messages of the previous window are missing from the current one.
+
+    The stored history is a sliding window over an append-only log, so the
+    current window is the previous one with some of its oldest messages
+    dropped and new ones appended. Aligning the two by position, rather than
+    by content, means a repeated "ok" is not mistaken for an earlier one.
+    """
+    for dropped in range(len(previous) + 1):
+        overlap = previous[dropped:]
+        if fingerprints[:len(overlap)] == overlap:
+            return dropped
+    return len(previous)
+
+
+class ContextBuilder:
+    """Turns stored chat history into chat-completions messages within `max_tokens`.
+
+    `summarize_fn(previous_summary, messages)` returns an updated summary or
+    None on failure. When the history overflows, turns are folded until the
+    rest fits in half the budget, so summaries are refreshed every few turns
+    rather than on every one. Without a `session_key` the oldest turns are
+    simply dropped.
+    """
+
+    def __init__(self, summarize_fn, max_tokens=1500, summary_tokens=250, count_tokens=None, cache_size=1024):
+        self.summarize_fn = summarize_fn
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self.count_tokens = count_tokens or TokenCounter()
+        self.cache_size = cache_size
+        self._summaries = OrderedDict()
+        self._lock = threading.Lock()
+        self.summaries_built = 0
+
+    def _cost(self, message):
+        return self.count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+    def _newest_within(self, messages, budget):
+        """Split `messages` into (older, newest) where the newest fit in `budget` tokens."""
+        used = 0
+        start = len(messages)
+        for i in range(len(messages) - 1, -1, -1):
+            cost = self._cost(messages[i])
+            if used + cost > budget:
+                break
+            used += cost
+            start = i
+        return messages[:start], messages[start:]
+
+    def _remember(self, session_key, state):
+        with self._lock:
+            self._summaries[session_key] = state
+            self._summaries.move_to_end(session_key)
+            while len(self._summaries) > self.cache_size:
+                self._summaries.popitem(last=False)
+
+    def build(self, chat_history, session_key=None):
+        """Messages for the LLM request: an optional summary followed by the newest turns."""
+        messages = [
+            {"role": ROLES.get(role, "user"), "content": content}
+            for entry in chat_history
+            for role, content in entry.items()
+            if content
+        ]
+        if session_key is None:
+            return self._newest_within(messages, self.max_tokens)[1]
+
+        # Per session: the summary, the last window seen, how many of its leading
+        # messages are in the summary, and the messages that slid out of the
+        # window before they were summarized
+        summary, folded, carried = None, 0, []
+        fingerprints = [_fingerprint(m) for m in messages]
+        with self._lock:
+            state = self._summaries.get(session_key)
+            if state is not None:
+                self._summaries.move_to_end(session_key)
+                summary, folded, carried = state["summary"], state["folded"], state["carried"]
+                dropped = _dropped_count(state["window"], fingerprints)
+                carried = carried + state["messages"][folded:dropped]
+                folded = max(0, folded - dropped)
+        pending = carried + messages[folded:]
+
+        budget = self.max_tokens - self.summary_tokens
+        total = sum(self._cost(m) for m in pending)
+        if (summary is not None or total > self.max_tokens) and total > budget:
+            older, _ = self._newest_within(pending, budget // 2)
+            new_summary = self.summarize_fn(summary, older)
+            if new_summary:
+                summary = new_summary
+                self.summaries_built += 1
+                folded += max(0, len(older) - len(carried))
+                carried = carried[len(older):]
+                pending = pending[len(older):]
+        # Unsummarized messages beyond the budget could never be sent whole again
+        carried = carried[len(carried) - len(self._newest_within(carried, self.max_tokens)[1]):]
+        self._remember(session_key, {
+            "summary": summary,
+            "window": fingerprints,
+            "messages": messages,
+            "folded": folded,
+            "carried": carried
+        })
+
+        if summary is None and total <= self.max_tokens:
+            return pending
+        recent = self._newest_within(pending, budget)[1]
+        if not summary:
+            return recent
+        return [{"role": "system", "content": f"Summary of the earlier conversation: {summary}"}] + recent
+
+    def stats(self):
+        return {
+            "max_tokens": self.max_tokens,
+            "sessions_summarized": sum(1 for state in list(self._summaries.values()) if state["summary"]),
+            "summaries_built": self.summaries_built
+        }
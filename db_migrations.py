@@ -0,0 +1,154 @@
+"""SQLite tuning and schema migrations for sigce.db.
+
+Usage:
+
+    python db_migrations.py [--database instance/sigce.db] [--status | --dry-run]
+
+`db.create_all()` only creates missing tables, so indexes and columns added
+to existing models never reach a database created by an older version. The
+numbered revisions below bring such a file up to date and record the
+revision they reached in `schema_version`, Alembic-style. Every step is
+idempotent, so a database that `create_all` built from the current models is
+just stamped. The app runs `upgrade` when it bootstraps the database; run
+this script ahead of a deploy to build the indexes of a large database
+without holding up the first request.
+
+`configure_sqlite` applies WAL mode and the other pragmas on every new
+connection, so readers no longer block behind a writer.
+"""
+import argparse
+import os
+import time
+
+from sqlalchemy import create_engine, event
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    # Durable at every checkpoint; only the last commits can be lost on power failure in WAL mode
+    "synchronous": "NORMAL",
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "cache_size": -int(os.getenv("SQLITE_CACHE_KB", "20000")),
+    "temp_store": "MEMORY",
+    "mmap_size": int(os.getenv("SQLITE_MMAP_BYTES", str(256 * 1024 * 1024)))
+}
+
+
+def configure_sqlite(engine, pragmas=None):
+    """Run the pragmas on each connection `engine` opens; no-op for other databases."""
+    if engine.dialect.name != "sqlite":
+        return
+    pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+
+def _columns(connection, table):
+    return {row[1] for row in connection.exec_driver_sql(f'PRAGMA table_info("{table}")')}
+
+
+def _has_table(connection, table):
+    return bool(_columns(connection, table))
+
+
+def _add_upload_job_pages(connection):
+    if _has_table(connection, "upload_job") and "pages" not in _columns(connection, "upload_job"):
+        connection.exec_driver_sql("ALTER TABLE upload_job ADD COLUMN pages TEXT")
+
+
+def _add_upload_job_pages_done(connection):
+    if _has_table(connection, "upload_job") and "pages_done" not in _columns(connection, "upload_job"):
+        connection.exec_driver_sql("ALTER TABLE upload_job ADD COLUMN pages_done INTEGER DEFAULT 0")
+
+
+def _create_indexes(connection):
+    # Kept in step with the __table_args__ of the models in merged_app.py
+    indexes = [
+        ("ix_chat_history_user_session_time", "chat_history", "user_id, session_id, timestamp"),
+        ("ix_login_log_timestamp", "login_log", "timestamp"),
+        ("ix_login_log_user_time", "login_log", "user_id, timestamp"),
+        ("ix_upload_job_user_status", "upload_job", "user_id, status, created_at")
+    ]
+    for name, table, columns in indexes:
+        if _has_table(connection, table):
+            connection.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+    connection.exec_driver_sql("ANALYZE")
+
+
+MIGRATIONS = [
+    (1, "add upload_job.pages", _add_upload_job_pages),
+    (2, "indexes for history, login log and upload job queries", _create_indexes),
+    (3, "add upload_job.pages_done", _add_upload_job_pages_done)
+]
+HEAD = MIGRATIONS[-1][0]
+
+
+def current_revision(connection):
+    connection.exec_driver_sql("CREATE TABLE IF NOT EXISTS schema_version (revision INTEGER NOT NULL)")
+    row = connection.exec_driver_sql("SELECT MAX(revision) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def pending(connection):
+    revision = current_revision(connection)
+    return [(number, description) for number, description, _ in MIGRATIONS if number > revision]
+
+
+def upgrade(engine, log=print):
+    """Apply the revisions the database has not seen yet; returns the ones applied."""
+    applied = []
+    with engine.connect() as connection:
+        # Take the write lock first so concurrently starting workers run each step once
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            revision = current_revision(connection)
+            for number, description, step in MIGRATIONS:
+                if number <= revision:
+                    continue
+                started = time.perf_counter()
+                step(connection)
+                connection.exec_driver_sql("INSERT INTO schema_version (revision) VALUES (?)", (number,))
+                applied.append(number)
+                log(f"Applied migration {number:04d} ({description}) in {time.perf_counter() - started:.2f}s")
+            connection.exec_driver_sql("COMMIT")
+        except BaseException:
+            connection.exec_driver_sql("ROLLBACK")
+            raise
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upgrade sigce.db to the current schema")
+    parser.add_argument("--database", default=os.path.join(HERE, "instance", "sigce.db"))
+    parser.add_argument("--status", action="store_true", help="print the current revision and exit")
+    parser.add_argument("--dry-run", action="store_true", help="list the pending migrations without applying them")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        parser.error(f"{args.database} does not exist")
+    engine = create_engine(f"sqlite:///{os.path.abspath(args.database)}")
+    configure_sqlite(engine)
+
+    if args.status or args.dry_run:
+        with engine.begin() as connection:
+            revision = current_revision(connection)
+            waiting = pending(connection)
+        print(f"{args.database}: revision {revision} of {HEAD}")
+        for number, description in waiting:
+            print(f"  pending {number:04d} {description}")
+        return
+
+    applied = upgrade(engine)
+    print(f"{args.database} is at revision {HEAD}" + ("" if applied else " (nothing to do)"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Text extraction for uploaded files.
+
+The per-file and per-page-range functions run in the upload job process
+pool, so they only depend on their arguments and never touch the Flask
+app, Firebase or the model. `extract_text` runs on the caller's thread and fans
+the CPU-bound work out to that pool.
+
+A source is either a path or, for uploads no larger than
+IN_MEMORY_MAX_BYTES, the file's bytes, which skips the temporary file.
+"""
+import io
+import os
+import time
+import uuid
+
+import PyPDF2
+import pytesseract
+from pdf2image import convert_from_bytes, convert_from_path
+from PIL import Image
+from werkzeug.utils import secure_filename
+
+# Tesseract OCR Path
+pytesseract.pytesseract.tesseract_cmd = os.getenv("TESSERACT_CMD", r"C:\Program Files\Tesseract-OCR\tesseract.exe")
+
+SUPPORTED_EXTENSIONS = (".png", ".jpg", ".jpeg", ".pdf", ".txt")
+
+# A page whose text layer has fewer characters than this is treated as scanned
+MIN_TEXT_LAYER_CHARS = 25
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+IN_MEMORY_MAX_BYTES = int(os.getenv("UPLOAD_IN_MEMORY_MAX_BYTES", str(2 * 1024 * 1024)))
+PDF_PAGES_PER_TASK = max(1, int(os.getenv("PDF_PAGES_PER_TASK", "4")))
+
+
+def _open(source):
+    return io.BytesIO(source) if isinstance(source, bytes) else source
+
+
+def extract_text_from_image(source):
+    """Extract text from image using OCR."""
+    try:
+        image = Image.open(_open(source))
+        return pytesseract.image_to_string(image)
+    except Exception as e:
+        print(f"Image processing error: {e}")
+        return ""
+
+
+def _extract_pdf_page(reader, source, page_number):
+    started = time.perf_counter()
+    text, method = "", "text"
+    try:
+        text = reader.pages[page_number].extract_text() or ""
+    except Exception as e:
+        print(f"PDF page {page_number + 1} text error: {e}")
+
+    if len(text.strip()) < MIN_TEXT_LAYER_CHARS:
+        try:
+            convert = convert_from_bytes if isinstance(source, bytes) else convert_from_path
+            images = convert(source, dpi=OCR_DPI, first_page=page_number + 1, last_page=page_number + 1)
+            ocr_text = "".join(pytesseract.image_to_string(image) for image in images)
+            if len(ocr_text.strip()) > len(text.strip()):
+                text, method = ocr_text, "ocr"
+        except Exception as e:
+            print(f"PDF page {page_number + 1} OCR error: {e}")
+
+    return {
+        "page": page_number + 1,
+        "text": text,
+        "method": method,
+        "seconds": round(time.perf_counter() - started, 3)
+    }
+
+
+def extract_pdf_pages(source, start, stop):
+    """Text of PDF pages `start` to `stop - 1`, OCR'd from a rasterized image when a page has no text layer.
+
+    The PDF is parsed once per call. Returns a list with a dict per page
+    holding the page number, text, method and elapsed seconds.
+    """
+    try:
+        reader = PyPDF2.PdfReader(_open(source))
+    except Exception as e:
+        print(f"PDF pages {start + 1}-{stop} read error: {e}")
+        return [{"page": n + 1, "text": "", "method": "text", "seconds": 0.0} for n in range(start, stop)]
+    return [_extract_pdf_page(reader, source, n) for n in range(start, stop)]
+
+
+def iter_pdf_pages(source, executor=None):
+    """Yield per-page results in page order, extracting ranges of pages in parallel on `executor`."""
+    try:
+        page_count = len(PyPDF2.PdfReader(_open(source)).pages)
+    except Exception as e:
+        print(f"PDF processing error: {e}")
+        return
+    # Each task ships the source and parses it once for PDF_PAGES_PER_TASK pages
+    starts = range(0, page_count, PDF_PAGES_PER_TASK)
+    stops = [min(start + PDF_PAGES_PER_TASK, page_count) for start in starts]
+    if executor is None:
+        chunks = (extract_pdf_pages(source, start, stop) for start, stop in zip(starts, stops))
+    else:
+        chunks = executor.map(extract_pdf_pages, [source] * len(starts), starts, stops)
+    for chunk in chunks:
+        yield from chunk
+
+
+def extract_text_from_pdf(source, executor=None, on_page=None):
+    """Extract text from PDF file, calling `on_page` with each page result as it arrives."""
+    texts = []
+    for result in iter_pdf_pages(source, executor):
+        texts.append(result["text"])
+        if on_page:
+            on_page(result)
+    return "\n".join(texts)
+
+
+def extract_text(filename, data, work_dir, executor=None, on_page=None):
+    """Extract text from the bytes of an uploaded file."""
+    filename = secure_filename(filename)
+    file_path = None
+    source = data
+    if len(data) > IN_MEMORY_MAX_BYTES and not filename.lower().endswith(".txt"):
+        # Large files are handed to the workers by path rather than copied to each one
+        file_path = os.path.join(work_dir, f"{uuid.uuid4().hex}_{filename}")
+        with open(file_path, "wb") as f:
+            f.write(data)
+        source = file_path
+
+    extracted_text = ""
+    try:
+        if filename.lower().endswith((".png", ".jpg", ".jpeg")):
+            if executor is None:
+                extracted_text = extract_text_from_image(source)
+            else:
+                extracted_text = executor.submit(extract_text_from_image, source).result()
+        elif filename.lower().endswith(".pdf"):
+            extracted_text = extract_text_from_pdf(source, executor, on_page)
+        elif filename.lower().endswith(".txt"):
+            extracted_text = data.decode("utf-8")
+    except Exception as e:
+        print(f"File processing error: {e}")
+
+    if file_path:
+        try:
+            os.remove(file_path)  # Clean up the uploaded file
+        except OSError:
+            pass
+
+    return extracted_text.strip()
@@ -0,0 +1,139 @@
+"""Per-session vector index over the chunks of uploaded documents.
+
+Each chat session gets its own small index on disk, so any worker process
+can answer follow-up questions about a document uploaded in that session:
+
+    {root}/{user_id}/{session_id}.npz
+        vectors  normalized float32 chunk embeddings
+        chunks   JSON list of {"filename", "chunk", "text"}
+"""
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from werkzeug.utils import secure_filename
+
+from embedding_index import normalize_rows
+from knowledge_base import _FileLock
+
+
+def chunk_text(text, chunk_words=200, overlap_words=40):
+    """Split text into overlapping windows of roughly `chunk_words` words."""
+    words = re.findall(r"\S+", text or "")
+    if not words:
+        return []
+    step = max(1, chunk_words - overlap_words)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + chunk_words]))
+        if start + chunk_words >= len(words):
+            break
+    return chunks
+
+
+class DocumentIndex:
+    """Chunk, embed and search the documents uploaded to each chat session.
+
+    Loaded session indexes are kept in a small LRU and reloaded when another
+    process has written a newer file.
+    """
+
+    def __init__(self, root, model_name, chunk_words=200, overlap_words=40, cache_size=64):
+        self.root = root
+        self.model_name = model_name
+        self.chunk_words = chunk_words
+        self.overlap_words = overlap_words
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, user_id, session_id):
+        return os.path.join(self.root, secure_filename(str(user_id)), f"{secure_filename(str(session_id))}.npz")
+
+    def _read(self, path):
+        try:
+            with np.load(path, allow_pickle=False) as saved:
+                if str(saved["model_name"]) != self.model_name:
+                    return None
+                return saved["vectors"].astype(np.float32, copy=False), json.loads(str(saved["chunks"]))
+        except Exception as e:
+            print(f"Document index load error: {e}")
+            return None
+
+    def _load(self, user_id, session_id):
+        """(vectors, chunks) of a session, or None when nothing was uploaded to it."""
+        path = self._path(user_id, session_id)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            entry = self._cache.get(path)
+            if entry is not None and entry[0] == mtime:
+                self._cache.move_to_end(path)
+                return entry[1]
+
+        loaded = self._read(path)
+        if loaded is None:
+            return None
+        with self._lock:
+            self._cache[path] = (mtime, loaded)
+            self._cache.move_to_end(path)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return loaded
+
+    def add_document(self, user_id, session_id, filename, text, encode):
+        """Chunk and embed a document and append it to the session's index.
+
+        Returns the number of chunks added.
+        """
+        chunks = chunk_text(text, self.chunk_words, self.overlap_words)
+        if not chunks:
+            return 0
+        vectors = normalize_rows(encode(chunks))
+        records = [{"filename": filename, "chunk": i, "text": chunk} for i, chunk in enumerate(chunks)]
+
+        path = self._path(user_id, session_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with _FileLock(f"{path}.lock"):
+            existing = self._read(path) if os.path.exists(path) else None
+            if existing is not None:
+                vectors = np.vstack([existing[0], vectors])
+                records = existing[1] + records
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(
+                    f,
+                    model_name=np.array(self.model_name),
+                    vectors=vectors,
+                    chunks=np.array(json.dumps(records, ensure_ascii=False)),
+                )
+            os.replace(tmp_path, path)
+        return len(chunks)
+
+    def has_documents(self, user_id, session_id):
+        return os.path.exists(self._path(user_id, session_id))
+
+    def search(self, user_id, session_id, query_embedding, k=4, min_score=None, filename=None):
+        """Top-k chunks of the session's documents as (chunk, score) pairs, best first.
+
+        With `filename`, only chunks of that uploaded file are considered.
+        """
+        loaded = self._load(user_id, session_id)
+        if loaded is None:
+            return []
+        vectors, chunks = loaded
+        scores = vectors @ normalize_rows(query_embedding)[0]
+        if filename is not None:
+            scores = np.where([c["filename"] == filename for c in chunks], scores, -np.inf)
+        k = min(k, int(np.isfinite(scores).sum()))
+        if k < 1:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(chunks[i], float(scores[i])) for i in best if min_score is None or scores[i] >= min_score]
@@ -0,0 +1,167 @@
+"""Sentence-embedding backends: PyTorch via sentence-transformers, or ONNX Runtime.
+
+Usage (export once, then point the app at the directory):
+
+    python embedding_backends.py export --model all-mpnet-base-v2 --output models/mpnet-onnx
+    EMBEDDING_BACKEND=onnx EMBEDDING_ONNX_PATH=models/mpnet-onnx python merged_app.py
+
+The export writes the transformer as `model.onnx`, a dynamically quantized
+int8 copy as `model_int8.onnx`, and the tokenizer. `OnnxEncoder` reproduces
+the sentence-transformers pipeline of the mpnet and MiniLM models (mean
+pooling over the attention mask, then L2 normalization) without importing
+torch, so a worker only holds the ONNX session and the tokenizer.
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+from embedding_index import normalize_rows
+
+ONNX_FILE = "model.onnx"
+QUANTIZED_FILE = "model_int8.onnx"
+CONFIG_FILE = "encoder_config.json"
+BACKENDS = ("torch", "onnx")
+
+
+class OnnxEncoder:
+    """Drop-in replacement for `SentenceTransformer.encode` on an exported model directory.
+
+    The int8 model is used when `quantized` is set and it was exported;
+    `threads` caps ONNX Runtime's intra-op thread pool per worker.
+    """
+
+    def __init__(self, model_dir, quantized=True, threads=None):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        config = {}
+        config_path = os.path.join(model_dir, CONFIG_FILE)
+        if os.path.exists(config_path):
+            with open(config_path, "r", encoding="utf-8") as f:
+                config = json.load(f)
+        self.max_length = config.get("max_length", 384)
+        self.model_name = config.get("model_name", os.path.basename(os.path.normpath(model_dir)))
+
+        filename = QUANTIZED_FILE if quantized and os.path.exists(os.path.join(model_dir, QUANTIZED_FILE)) else ONNX_FILE
+        self.model_path = os.path.join(model_dir, filename)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+    @property
+    def quantized(self):
+        return os.path.basename(self.model_path) == QUANTIZED_FILE
+
+    def encode(self, sentences, batch_size=32, **kwargs):
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        if not len(sentences):
+            return np.zeros((0, 0), dtype=np.float32)
+
+        # Sorting by length keeps padding per batch small
+        order = np.argsort([-len(s) for s in sentences], kind="stable")
+        pooled = np.empty(len(sentences), dtype=object)
+        for start in range(0, len(sentences), batch_size):
+            rows = order[start:start + batch_size]
+            tokens = self.tokenizer([sentences[i] for i in rows], padding=True, truncation=True,
+                                    max_length=self.max_length, return_tensors="np")
+            feed = {name: value.astype(np.int64) for name, value in tokens.items() if name in self.input_names}
+            hidden = self.session.run(None, feed)[0]
+            mask = tokens["attention_mask"][..., None].astype(np.float32)
+            means = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            for row, vector in zip(rows, means):
+                pooled[row] = vector
+
+        embeddings = normalize_rows(np.stack(list(pooled)))
+        return embeddings[0] if single else embeddings
+
+
+def encoder_key(backend, model_name, onnx_path=None, quantized=True):
+    """The name embedding indexes are stored under, so vectors from different backends never mix."""
+    if backend != "onnx":
+        return model_name
+    if onnx_path and not (quantized and os.path.exists(os.path.join(onnx_path, QUANTIZED_FILE))):
+        return f"{model_name}+onnx"
+    return f"{model_name}+onnx-int8"
+
+
+def load_encoder(backend="torch", model_name="all-mpnet-base-v2", onnx_path=None, quantized=True, threads=None):
+    """An object with a SentenceTransformer-compatible `encode` for the configured backend."""
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name)
+    if backend == "onnx":
+        if not onnx_path:
+            raise ValueError("The onnx embedding backend needs the directory written by `embedding_backends.py export`")
+        return OnnxEncoder(onnx_path, quantized=quantized, threads=threads)
+    raise ValueError(f"Unknown embedding backend: {backend!r} (expected one of {', '.join(BACKENDS)})")
+
+
+def export_model(model_name, output_dir, quantize=True, opset=17):
+    """Export a sentence-transformers model to ONNX, plus an int8 copy when `quantize` is set."""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    source = SentenceTransformer(model_name, device="cpu")
+    transformer = source[0].auto_model.eval()
+    tokenizer = source.tokenizer
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer.save_pretrained(output_dir)
+
+    sample = tokenizer(["What are the college timings?"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+
+    class HiddenStates(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs)))[0]
+
+    onnx_path = os.path.join(output_dir, ONNX_FILE)
+    axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+    with torch.no_grad():
+        torch.onnx.export(HiddenStates(transformer), tuple(sample[name] for name in input_names), onnx_path,
+                          input_names=input_names, output_names=["last_hidden_state"],
+                          dynamic_axes=axes, opset_version=opset)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(onnx_path, os.path.join(output_dir, QUANTIZED_FILE), weight_type=QuantType.QInt8)
+
+    with open(os.path.join(output_dir, CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "model_name": model_name,
+            "max_length": source.max_seq_length,
+            "dimension": source.get_sentence_embedding_dimension(),
+            "pooling": "mean"
+        }, f, indent=2)
+    return output_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding backend tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="export a sentence-transformers model to ONNX")
+    export.add_argument("--model", default="all-mpnet-base-v2",
+                        help="e.g. all-mpnet-base-v2, all-MiniLM-L6-v2 or all-MiniLM-L12-v2")
+    export.add_argument("--output", required=True)
+    export.add_argument("--no-quantize", action="store_true", help="skip the int8 copy")
+    export.add_argument("--opset", type=int, default=17)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_model(args.model, args.output, quantize=not args.no_quantize, opset=args.opset)
+        print(f"Exported {args.model} to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Persistent embedding index for the data.json knowledge base."""
+import hashlib
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from retrievers import ExactRetriever
+
+
+def question_hash(text):
+    """Content hash used to decide whether a question must be re-encoded."""
+    return hashlib.sha256(text.strip().encode("utf-8")).hexdigest()
+
+
+def normalize_rows(vectors):
+    """Scale every row to unit length so a dot product is a cosine similarity."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class EmbeddingIndex:
+    """Normalized float32 matrix of question embeddings, cached on disk.
+
+    Rows are keyed by a SHA-256 of the question text, so only new or edited
+    questions are sent through the model when the knowledge base changes.
+    Nearest-neighbour queries go through a pluggable retriever backend.
+    """
+
+    def __init__(self, path, model_name, retriever=None):
+        self.path = path
+        self.model_name = model_name
+        self.hashes = []
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.retriever = retriever or ExactRetriever()
+        self.source_version = None
+        self._lock = threading.Lock()
+        self.load()
+        self.retriever.build(self.vectors)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def load(self):
+        """Load a previously saved index, ignoring files built by another model."""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as saved:
+                if str(saved["model_name"]) != self.model_name:
+                    return
+                self.hashes = [str(h) for h in saved["hashes"]]
+                self.vectors = saved["vectors"].astype(np.float32, copy=False)
+        except Exception as e:
+            print(f"Embedding index load error: {e}")
+            self.hashes = []
+            self.vectors = np.zeros((0, 0), dtype=np.float32)
+
+    def save(self):
+        """Atomically write the index next to data.json.
+
+        Each writer uses its own temporary file, so processes saving at the
+        same time never interleave their bytes; the last replace wins.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(self.path)}.", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(
+                    f,
+                    model_name=np.array(self.model_name),
+                    hashes=np.array(self.hashes, dtype=str),
+                    vectors=self.vectors,
+                )
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"Embedding index save error: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def sync(self, questions, encode, version=None):
+        """Make the index rows line up with `questions`, encoding only what changed.
+
+        `version` identifies the knowledge base snapshot; when it matches the
+        last synced one the questions are not even hashed.
+        """
+        if version is not None and version == self.source_version:
+            return False
+        hashes = [question_hash(q) for q in questions]
+        if hashes == self.hashes:
+            self.source_version = version
+            return False
+
+        with self._lock:
+            if hashes == self.hashes:
+                self.source_version = version
+                return False
+
+            known = {h: self.vectors[i] for i, h in enumerate(self.hashes)}
+            missing = [i for i, h in enumerate(hashes) if h not in known]
+            fresh = {}
+            if missing:
+                encoded = normalize_rows(encode([questions[i] for i in missing]))
+                fresh = {hashes[i]: encoded[row] for row, i in enumerate(missing)}
+
+            rows = [known[h] if h in known else fresh[h] for h in hashes]
+            vectors = np.vstack(rows).astype(np.float32) if rows else np.zeros((0, 0), dtype=np.float32)
+            appended = len(hashes) > len(self.hashes) and hashes[:len(self.hashes)] == self.hashes
+            if appended and self.hashes:
+                self.retriever.add(vectors[len(self.hashes):])
+            else:
+                self.retriever.build(vectors)
+            self.vectors = vectors
+            self.hashes = hashes
+            self.source_version = version
+            self.save()
+        return True
+
+    def search(self, query_embedding):
+        """Cosine similarity of one query embedding against every stored question."""
+        if not self.hashes:
+            return np.zeros(0, dtype=np.float32)
+        return self.vectors @ normalize_rows(query_embedding)[0]
+
+    def top_k(self, query_embedding, k=1):
+        """Return up to `k` (row, score) pairs from the retriever backend, best first."""
+        return self.retriever.search(normalize_rows(query_embedding)[0], k)
@@ -0,0 +1,165 @@
+"""Shared sentence-embedding worker with cross-request micro-batching.
+
+One process loads the SentenceTransformer and listens on a Unix socket.
+Queries that arrive within a few milliseconds of each other, from any
+gunicorn worker, are encoded in a single batch. Start it with:
+
+    python embedding_service.py --socket /tmp/queryverse-embeddings.sock
+
+and point the web workers at it with EMBEDDING_SERVICE_SOCKET.
+"""
+import argparse
+import os
+import queue
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+
+class EmbeddingService:
+    """Collects encode requests from many connections and runs them in batches."""
+
+    def __init__(self, encoder, batch_window=0.005, max_batch=64):
+        self.encoder = encoder
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.encoded = 0
+
+    def _collect(self):
+        """Block for one request, then gather more until the window closes or the batch is full."""
+        batch = [self.requests.get()]
+        size = len(batch[0][1])
+        deadline = time.monotonic() + self.batch_window
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[1])
+        return batch
+
+    def run_batcher(self):
+        while True:
+            batch = self._collect()
+            texts = [text for _, request_texts in batch for text in request_texts]
+            try:
+                vectors = np.asarray(self.encoder.encode(texts), dtype=np.float32)
+                error = None
+            except Exception as e:
+                vectors, error = None, str(e)
+            self.batches += 1
+            self.encoded += len(texts)
+
+            offset = 0
+            for reply, request_texts in batch:
+                if error is None:
+                    reply(("ok", vectors[offset:offset + len(request_texts)]))
+                else:
+                    reply(("error", error))
+                offset += len(request_texts)
+
+    def handle_connection(self, conn):
+        send_lock = threading.Lock()
+
+        def reply(message):
+            with send_lock:
+                try:
+                    conn.send(message)
+                except (OSError, EOFError):
+                    pass
+
+        try:
+            while True:
+                texts = conn.recv()
+                self.requests.put((reply, list(texts)))
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def serve(self, socket_path, authkey=None):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        listener = Listener(socket_path, family="AF_UNIX", authkey=authkey)
+        os.chmod(socket_path, 0o600)
+        threading.Thread(target=self.run_batcher, name="embedding-batcher", daemon=True).start()
+        print(f"Embedding service listening on {socket_path}")
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                print(f"Embedding service accept error: {e}")
+                continue
+            threading.Thread(target=self.handle_connection, args=(conn,), daemon=True).start()
+
+
+class RemoteEncoder:
+    """Drop-in replacement for `SentenceTransformer.encode` backed by the shared service.
+
+    Each thread keeps its own connection, so concurrent requests inside one
+    worker are batched together on the service side as well.
+    """
+
+    def __init__(self, socket_path, authkey=None):
+        self.socket_path = socket_path
+        self.authkey = authkey
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = Client(self.socket_path, family="AF_UNIX", authkey=self.authkey)
+            self._local.conn = conn
+        return conn
+
+    def encode(self, sentences, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        conn = self._connection()
+        try:
+            conn.send(texts)
+            status, payload = conn.recv()
+        except (EOFError, OSError):
+            # The service restarted; drop the stale connection so the next call reconnects
+            self._local.conn = None
+            raise
+        if status != "ok":
+            raise RuntimeError(f"Embedding service error: {payload}")
+        return payload[0] if single else payload
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared sentence-embedding service")
+    parser.add_argument("--socket", default=os.getenv("EMBEDDING_SERVICE_SOCKET", "/tmp/queryverse-embeddings.sock"))
+    parser.add_argument("--model", default=os.getenv("EMBEDDING_MODEL_NAME", "all-mpnet-base-v2"))
+    parser.add_argument("--backend", default=os.getenv("EMBEDDING_BACKEND", "torch"), help="torch or onnx")
+    parser.add_argument("--onnx-path", default=os.getenv("EMBEDDING_ONNX_PATH"))
+    parser.add_argument("--no-quantized", action="store_true", help="use the float ONNX model, not the int8 one")
+    parser.add_argument("--threads", type=int, help="ONNX Runtime intra-op threads")
+    parser.add_argument("--batch-window-ms", type=float, default=5.0)
+    parser.add_argument("--max-batch", type=int, default=64)
+    args = parser.parse_args()
+
+    from embedding_backends import load_encoder
+
+    authkey = os.getenv("EMBEDDING_SERVICE_AUTHKEY")
+    encoder = load_encoder(args.backend, args.model, onnx_path=args.onnx_path,
+                           quantized=not args.no_quantized, threads=args.threads)
+    service = EmbeddingService(
+        encoder,
+        batch_window=args.batch_window_ms / 1000.0,
+        max_batch=args.max_batch
+    )
+    service.serve(args.socket, authkey=authkey.encode() if authkey else None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Content-addressed on-disk cache of text extracted from uploaded files.
+
+Entries are keyed by a SHA-256 of the file bytes (plus the extension, which
+selects the extractor), so re-uploading the same syllabus or notice skips
+OCR and PDF parsing entirely. Files are shared by every worker process:
+
+    {root}/{key[:2]}/{key}.txt
+
+Reads bump the file's mtime, and once the directory grows past `max_bytes`
+the least recently used entries are deleted.
+"""
+import hashlib
+import os
+import threading
+import uuid
+
+
+def content_key(filename, data):
+    """Cache key for an upload: SHA-256 of its bytes and its lower-cased extension."""
+    extension = os.path.splitext(filename)[1].lower().lstrip(".")
+    return f"{hashlib.sha256(data).hexdigest()}.{extension or 'bin'}"
+
+
+class ExtractionCache:
+    """Size-bounded LRU of extracted text, stored as one file per upload."""
+
+    def __init__(self, root, max_bytes=256 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.txt")
+
+    def _entries(self):
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.endswith(".txt"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def get(self, key):
+        """Cached text for `key`, or None."""
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except OSError as e:
+            print(f"Extraction cache read error: {e}")
+            self.misses += 1
+            return None
+        self.hits += 1
+        return text
+
+    def set(self, key, text):
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Extraction cache write error: {e}")
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += len(text.encode("utf-8"))
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Other workers write here too, so re-measure from disk before deleting
+        entries = sorted(self._entries())
+        size = sum(entry_size for _, entry_size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, entry_size, path in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+        self._size = size
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "bytes": self._size,
+            "max_bytes": self.max_bytes
+        }
@@ -0,0 +1,25 @@
+"""Gunicorn settings, picked up automatically from the working directory.
+
+With PRELOAD_APP=1 the master imports merged_app and loads the embedding
+model before forking, so workers boot in milliseconds and share the model
+weights copy-on-write instead of each holding a private copy. Each worker
+then starts its own background threads in `post_fork`.
+"""
+import gc
+import os
+
+preload_app = os.getenv("PRELOAD_APP", "0") == "1"
+
+
+def when_ready(server):
+    if preload_app:
+        # Objects created during preload are never collected, so the collector
+        # does not write to (and un-share) their pages in the workers
+        gc.collect()
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        import merged_app
+        merged_app.start_worker()
@@ -0,0 +1,217 @@
+"""Hybrid lexical + semantic retrieval for the knowledge base.
+
+A BM25 inverted index over questions (and, at a lower weight, answers)
+proposes candidates cheaply; on small knowledge bases a RapidFuzz scan of
+the questions adds typo-tolerant candidates too.
+Only those candidates, plus the few nearest semantic neighbours, are scored
+against the query embedding. The final score is a weighted sum of the three
+signals, each scaled to 0..1.
+"""
+import math
+import threading
+from collections import Counter
+
+import numpy as np
+
+from embedding_index import normalize_rows
+from knowledge_base import normalize_question
+
+try:
+    from rapidfuzz import fuzz, process
+except ImportError:
+    fuzz = process = None
+
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i if in is it me my of on or "
+    "the there this to was what when where which who why will with you your".split()
+)
+
+
+# (semantic, bm25, fuzzy)
+DEFAULT_WEIGHTS = (0.6, 0.25, 0.15)
+
+
+def parse_weights(text):
+    """Weights from a "semantic,bm25,fuzzy" string; the defaults, with a warning, if it is malformed."""
+    try:
+        weights = tuple(float(w) for w in text.split(","))
+    except (AttributeError, ValueError):
+        weights = ()
+    if len(weights) != 3 or any(w < 0 for w in weights) or not sum(weights):
+        print(f"Ignoring HYBRID_WEIGHTS={text!r}: expected three non-negative numbers, using {DEFAULT_WEIGHTS}")
+        return DEFAULT_WEIGHTS
+    return weights
+
+
+def _stem(token):
+    # Plural folding only, so "timings" finds "timing" without a stemmer dependency
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    return [_stem(token) for token in normalize_question(text or "").split() if token not in STOPWORDS]
+
+
+class LexicalIndex:
+    """BM25 over the rows of an EmbeddingIndex, rebuilt by `sync` when the rows change.
+
+    Question tokens count `question_weight` times, so a keyword in the
+    question outranks the same keyword buried in a long answer.
+    """
+
+    def __init__(self, k1=1.5, b=0.75, question_weight=3):
+        self.k1 = k1
+        self.b = b
+        self.question_weight = question_weight
+        self.postings = {}
+        self.idf = {}
+        self.questions = []  # normalized question text per row
+        self._hashes = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.questions)
+
+    def sync(self, queries, index):
+        hashes = index.hashes
+        if hashes is self._hashes:
+            return False
+
+        rows = min(len(queries), len(hashes))
+        postings, lengths, questions = {}, [], []
+        for row in range(rows):
+            entry = queries[row]
+            question_text = " ".join([entry.get("question", "")] + list(entry.get("aliases") or []))
+            terms = Counter()
+            for token in tokenize(question_text):
+                terms[token] += self.question_weight
+            terms.update(tokenize(entry.get("answer", "")))
+            lengths.append(sum(terms.values()))
+            questions.append(normalize_question(entry.get("question", "")))
+            for token, tf in terms.items():
+                postings.setdefault(token, []).append((row, tf))
+
+        average = (sum(lengths) / len(lengths)) if lengths else 0.0
+        scored = {}
+        for token, docs in postings.items():
+            rows_array = np.array([row for row, _ in docs], dtype=np.int64)
+            tf = np.array([tf for _, tf in docs], dtype=np.float32)
+            norm = np.array([lengths[row] for row, _ in docs], dtype=np.float32) / (average or 1.0)
+            # Precompute the BM25 term weight of every posting
+            weight = tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * norm))
+            scored[token] = (rows_array, weight)
+        idf = {token: math.log(1 + (rows - len(docs) + 0.5) / (len(docs) + 0.5)) for token, docs in postings.items()}
+
+        with self._lock:
+            self.postings = scored
+            self.idf = idf
+            self.questions = questions
+            self._hashes = hashes
+        return True
+
+    def search(self, query, n=20):
+        """Top-n (row, score) pairs; scores are divided by the best score any row could reach."""
+        tokens = set(tokenize(query))
+        with self._lock:
+            postings, idf, size = self.postings, self.idf, len(self.questions)
+        scores = np.zeros(size, dtype=np.float32)
+        ceiling = 0.0
+        for token in tokens:
+            if token not in postings:
+                continue
+            rows, weight = postings[token]
+            ceiling += idf[token] * (self.k1 + 1)
+            scores[rows] += idf[token] * weight
+        if not ceiling:
+            return []
+        matched = np.flatnonzero(scores)
+        if len(matched) > n:
+            matched = matched[np.argpartition(-scores[matched], n - 1)[:n]]
+        matched = matched[np.argsort(-scores[matched])]
+        return [(int(row), float(scores[row] / ceiling)) for row in matched]
+
+    def fuzzy(self, query, n=20):
+        """Top-n (row, score) pairs by RapidFuzz similarity of the question text, 0..1."""
+        if process is None or not self.questions:
+            return []
+        matches = process.extract(normalize_question(query), self.questions, scorer=fuzz.WRatio, limit=n)
+        return [(row, score / 100.0) for _, score, row in matches]
+
+
+class HybridRetriever:
+    """Fuses BM25, fuzzy and embedding scores for the candidates of a query.
+
+    `weights` are (semantic, bm25, fuzzy) and are normalized to sum to one;
+    the fuzzy weight is dropped when RapidFuzz is not installed. Above
+    `fuzzy_scan_limit` entries the fuzzy score is only computed for the
+    BM25 and semantic candidates, since a full scan grows linearly.
+    """
+
+    def __init__(self, weights=DEFAULT_WEIGHTS, candidates=20, lexical=None, fuzzy_scan_limit=5000):
+        if fuzz is None:
+            weights = (weights[0], weights[1], 0.0)
+        total = sum(weights) or 1.0
+        self.weights = tuple(w / total for w in weights)
+        self.candidates = candidates
+        self.fuzzy_scan_limit = fuzzy_scan_limit
+        self.lexical = lexical or LexicalIndex()
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self.queries = 0
+        self.reranked = 0
+
+    @property
+    def ready(self):
+        return len(self.lexical) > 0
+
+    def sync(self, queries, index):
+        changed = self.lexical.sync(queries, index)
+        if changed:
+            self._vectors = index.vectors
+        return changed
+
+    def search(self, query, query_embedding, k=1, semantic_candidates=()):
+        """Top-k (row, fused score) pairs, best first.
+
+        `semantic_candidates` are (row, cosine) pairs from the embedding
+        index, so paraphrases without shared words are still considered.
+        """
+        bm25 = dict(self.lexical.search(query, self.candidates))
+        fuzzy = {}
+        if len(self.lexical) <= self.fuzzy_scan_limit:
+            fuzzy = dict(self.lexical.fuzzy(query, self.candidates))
+        semantic = dict(semantic_candidates)
+        vectors = self._vectors
+        limit = min(len(vectors), len(self.lexical.questions))
+        rows = [row for row in set(bm25) | set(fuzzy) | set(semantic) if row < limit]
+        self.queries += 1
+        self.reranked += len(rows)
+        if not rows:
+            return []
+
+        missing = [row for row in rows if row not in semantic]
+        if missing:
+            cosines = vectors[missing] @ normalize_rows(query_embedding)[0]
+            semantic.update(zip(missing, cosines.tolist()))
+
+        if fuzz is not None:
+            normalized = normalize_question(query)
+            for row in rows:
+                if row not in fuzzy:
+                    fuzzy[row] = fuzz.WRatio(normalized, self.lexical.questions[row]) / 100.0
+
+        w_semantic, w_bm25, w_fuzzy = self.weights
+        fused = [
+            (row, w_semantic * max(semantic[row], 0.0) + w_bm25 * bm25.get(row, 0.0) + w_fuzzy * fuzzy.get(row, 0.0))
+            for row in rows
+        ]
+        fused.sort(key=lambda item: item[1], reverse=True)
+        return fused[:k]
+
+    def stats(self):
+        return {
+            "weights": self.weights,
+            "queries": self.queries,
+            "avg_candidates": self.reranked / self.queries if self.queries else 0.0
+        }
@@ -0,0 +1,109 @@
+"""Intent routing over the `category` field of knowledge base entries.
+
+Each category with enough entries gets a centroid embedding. A query is
+assigned the category of its nearest centroid, and semantic matching then
+scans only the entries of the closest few categories plus the small and
+uncategorized ones, instead of the whole knowledge base.
+"""
+import threading
+
+import numpy as np
+
+from embedding_index import normalize_rows
+
+
+class IntentRouter:
+    """Category centroids and per-category row partitions of an EmbeddingIndex.
+
+    Rebuilt by `sync` whenever the index rows change. Categories with fewer
+    than `min_entries` entries are not predicted; their rows are searched
+    on every query together with the `search_categories` best partitions.
+    """
+
+    def __init__(self, min_entries=3, search_categories=3):
+        self.min_entries = min_entries
+        self.search_categories = search_categories
+        self.categories = []
+        self.centroids = np.zeros((0, 0), dtype=np.float32)
+        self.partitions = {}
+        self.always_searched = np.zeros(0, dtype=np.int64)
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._hashes = None
+        self._lock = threading.Lock()
+        self.routed = 0
+        self.rows_scanned = 0
+        self.rows_total = 0
+
+    @property
+    def ready(self):
+        return len(self.categories) > 1
+
+    def sync(self, queries, index):
+        """Rebuild centroids from `queries` and the matching rows of `index` if they changed."""
+        hashes, vectors = index.hashes, index.vectors
+        if hashes is self._hashes:
+            return False
+
+        rows = min(len(queries), len(hashes), len(vectors))
+        by_category = {}
+        for row in range(rows):
+            by_category.setdefault(queries[row].get("category"), []).append(row)
+
+        categories, centroids, partitions, leftover = [], [], {}, []
+        for category, members in sorted(by_category.items(), key=lambda item: str(item[0])):
+            if category and len(members) >= self.min_entries:
+                categories.append(category)
+                centroids.append(vectors[members].mean(axis=0))
+                partitions[category] = np.array(members, dtype=np.int64)
+            else:
+                leftover.extend(members)
+
+        with self._lock:
+            self.categories = categories
+            self.centroids = normalize_rows(centroids) if centroids else np.zeros((0, 0), dtype=np.float32)
+            self.partitions = partitions
+            self.always_searched = np.array(sorted(leftover), dtype=np.int64)
+            self._vectors = vectors
+            self._hashes = hashes
+        return True
+
+    def route(self, query_embedding):
+        """Categories ranked by centroid similarity as (category, score) pairs."""
+        with self._lock:
+            categories, centroids = self.categories, self.centroids
+        if not categories:
+            return []
+        scores = centroids @ normalize_rows(query_embedding)[0]
+        order = np.argsort(-scores)
+        return [(categories[i], float(scores[i])) for i in order]
+
+    def predict(self, query_embedding):
+        """The most likely category of a query, or None before the router is built."""
+        ranked = self.route(query_embedding)
+        return ranked[0][0] if ranked else None
+
+    def search(self, query_embedding, k=1):
+        """Top-k (row, score) pairs within the query's best partitions, best first."""
+        ranked = self.route(query_embedding)
+        with self._lock:
+            vectors, partitions, always = self._vectors, self.partitions, self.always_searched
+        candidates = [partitions[category] for category, _ in ranked[:self.search_categories]] + [always]
+        rows = np.concatenate(candidates) if candidates else np.zeros(0, dtype=np.int64)
+        self.routed += 1
+        self.rows_scanned += len(rows)
+        self.rows_total += len(vectors)
+        if not len(rows):
+            return []
+
+        scores = vectors[rows] @ normalize_rows(query_embedding)[0]
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(rows[i]), float(scores[i])) for i in top]
+
+    def stats(self):
+        return {
+            "categories": len(self.categories),
+            "routed_queries": self.routed,
+            "scan_fraction": self.rows_scanned / self.rows_total if self.rows_total else 0.0
+        }
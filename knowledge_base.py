@@ -0,0 +1,271 @@
+"""Process-resident knowledge base backed by data.json and an append-only journal."""
+import json
+import os
+import re
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+
+def normalize_question(text):
+    """Fold case, punctuation and whitespace so trivially different phrasings share a key."""
+    text = re.sub(r"[^\w\s]", " ", text.casefold())
+    return " ".join(text.split())
+
+
+class _FileLock:
+    """Advisory lock shared by every worker process that appends to the journal."""
+
+    def __init__(self, path):
+        self.path = path
+        self._handle = None
+
+    def __enter__(self):
+        self._handle = open(self.path, "a")
+        if fcntl:
+            fcntl.flock(self._handle, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self._handle, fcntl.LOCK_UN)
+        self._handle.close()
+        self._handle = None
+
+
+class KnowledgeBase:
+    """Loads data.json once and serves every lookup from memory.
+
+    Learned Q&A pairs are appended to a JSONL journal instead of rewriting
+    data.json. A background thread periodically folds the journal back into
+    data.json. Other worker processes pick up journal lines by tailing the file.
+    A hash index on the normalized question text answers verbatim repeats
+    without running the embedding model.
+
+    Journal lines of the form {"alias_of": ..., "question": ...} record a
+    rephrasing of an existing question; the alias is answered by the
+    canonical entry and stored in its `aliases` list on compaction.
+    """
+
+    def __init__(self, path, journal_path=None):
+        self.path = path
+        self.journal_path = journal_path or os.path.splitext(path)[0] + ".journal.jsonl"
+        self.version = 0
+        self._queries = []
+        self._exact = {}
+        self.exact_lookups = 0
+        self.exact_hits = 0
+        self.duplicate_inserts = 0
+        self._data_stamp = None
+        self._journal_offset = 0
+        self._lock = threading.RLock()
+        self._file_lock = _FileLock(self.journal_path + ".lock")
+        self._compactor = None
+        self.reload()
+
+    def __len__(self):
+        return len(self._queries)
+
+    @staticmethod
+    def _stamp(path):
+        try:
+            st = os.stat(path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def _read_data_file(self):
+        if not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f).get("queries", [])
+        except json.JSONDecodeError as e:
+            print(f"Knowledge base load error: {e}")
+            return []
+
+    def _read_journal(self, offset):
+        """Return entries written after `offset` and the offset of the last complete line."""
+        if not os.path.exists(self.journal_path):
+            return [], 0
+        with open(self.journal_path, "rb") as f:
+            f.seek(offset)
+            chunk = f.read()
+        end = chunk.rfind(b"\n") + 1
+        entries = []
+        for line in chunk[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                print("Skipping corrupt knowledge base journal line")
+        return entries, offset + end
+
+    @staticmethod
+    def _split_records(records):
+        """Separate journal records into new entries and alias records."""
+        entries = [r for r in records if "alias_of" not in r]
+        aliases = [r for r in records if "alias_of" in r]
+        return entries, aliases
+
+    def reload(self):
+        """Rebuild the in-memory view from data.json plus the journal."""
+        with self._lock:
+            self._data_stamp = self._stamp(self.path)
+            queries = self._read_data_file()
+            records, self._journal_offset = self._read_journal(0)
+            entries, aliases = self._split_records(records)
+            self._queries = queries + entries
+            self._exact = {}
+            self._index_exact(self._queries)
+            self._index_aliases(aliases)
+            self.version += 1
+
+    def _index_exact(self, entries):
+        # The first entry wins, so curated data.json answers beat learned ones
+        for entry in entries:
+            for question in [entry.get("question", "")] + list(entry.get("aliases") or []):
+                key = normalize_question(question)
+                if key:
+                    self._exact.setdefault(key, entry)
+
+    def _index_aliases(self, aliases):
+        for record in aliases:
+            canonical = self._exact.get(normalize_question(record.get("alias_of", "")))
+            key = normalize_question(record.get("question", ""))
+            if canonical is not None and key:
+                self._exact.setdefault(key, canonical)
+
+    def refresh(self):
+        """Pick up changes written by other processes; costs two stat calls when idle."""
+        with self._lock:
+            if self._stamp(self.path) != self._data_stamp:
+                self.reload()
+                return
+            try:
+                journal_size = os.path.getsize(self.journal_path)
+            except OSError:
+                journal_size = 0
+            if journal_size < self._journal_offset:
+                self.reload()
+            elif journal_size > self._journal_offset:
+                records, self._journal_offset = self._read_journal(self._journal_offset)
+                if records:
+                    entries, aliases = self._split_records(records)
+                    self._queries = self._queries + entries
+                    self._index_exact(entries)
+                    self._index_aliases(aliases)
+                    self.version += 1
+
+    def snapshot(self):
+        """Return the current entries in the data.json layout, tagged with a version."""
+        self.refresh()
+        with self._lock:
+            return {"queries": self._queries, "version": self.version}
+
+    def find_exact(self, question):
+        """Return the entry whose normalized question equals `question`, if any."""
+        entry = self._exact.get(normalize_question(question))
+        self.exact_lookups += 1
+        if entry is not None:
+            self.exact_hits += 1
+        return entry
+
+    def stats(self):
+        """Counters for the admin metrics endpoint (per worker process)."""
+        return {
+            "entries": len(self._queries),
+            "version": self.version,
+            "exact_lookups": self.exact_lookups,
+            "exact_hits": self.exact_hits,
+            "exact_hit_rate": self.exact_hits / self.exact_lookups if self.exact_lookups else 0.0,
+            "duplicate_inserts": self.duplicate_inserts,
+        }
+
+    def add(self, question, answer, **fields):
+        """Append a learned Q&A pair to the journal and the in-memory view.
+
+        Returns None without writing when the normalized question is already
+        stored, including by another worker that answered it a moment ago.
+        """
+        entry = {"question": question, "answer": answer, **fields}
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock, self._file_lock:
+            # Under the journal lock, so concurrent inserts of one question collapse to one line
+            self.refresh()
+            if normalize_question(question) in self._exact:
+                self.duplicate_inserts += 1
+                return None
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self.refresh()
+        return entry
+
+    def add_alias(self, canonical_question, question):
+        """Record `question` as another phrasing of the stored `canonical_question`.
+
+        Returns False when the canonical entry is unknown or `question` is
+        already answered by an entry of its own.
+        """
+        line = json.dumps({"alias_of": canonical_question, "question": question}, ensure_ascii=False) + "\n"
+        with self._lock, self._file_lock:
+            self.refresh()
+            if normalize_question(canonical_question) not in self._exact:
+                return False
+            if normalize_question(question) in self._exact:
+                self.duplicate_inserts += 1
+                return False
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self.refresh()
+        return True
+
+    def compact(self):
+        """Fold the journal into data.json and truncate it."""
+        with self._lock, self._file_lock:
+            records, _ = self._read_journal(0)
+            if not records:
+                return False
+            entries, aliases = self._split_records(records)
+            queries = self._read_data_file() + entries
+            by_question = {}
+            for entry in queries:
+                for question in [entry.get("question", "")] + list(entry.get("aliases") or []):
+                    by_question.setdefault(normalize_question(question), entry)
+            for record in aliases:
+                canonical = by_question.get(normalize_question(record["alias_of"]))
+                if canonical is not None:
+                    canonical.setdefault("aliases", []).append(record["question"])
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump({"queries": queries}, f, indent=4, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+                open(self.journal_path, "w").close()
+            except Exception as e:
+                print(f"Knowledge base compaction error: {e}")
+                return False
+            self.reload()
+        return True
+
+    def start_compactor(self, interval):
+        """Run `compact` every `interval` seconds on a daemon thread."""
+        if self._compactor is not None or interval <= 0:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                self.compact()
+
+        self._compactor = threading.Thread(target=run, name="kb-compactor", daemon=True)
+        self._compactor.start()
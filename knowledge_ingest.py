@@ -0,0 +1,158 @@
+"""Asynchronous, quality-gated learning of Q&A pairs from LLM answers.
+
+Chat turns hand their question and answer to `KnowledgeIngestor.submit`,
+which rejects failure strings and trivial pairs straight away and queues
+the rest. A background thread embeds each batch and either stores a new
+entry or, when the question is a near-duplicate of a stored one, records it
+as an alias of that canonical entry. This stage is the only writer of the
+embedding index, so the search path never encodes knowledge base entries.
+New entries are tagged with the category predicted by the intent router.
+"""
+import threading
+import time
+
+import numpy as np
+
+from embedding_index import normalize_rows, question_hash
+from knowledge_base import normalize_question
+from write_behind import WriteBehindQueue
+
+# Answers that start like this are error messages rather than knowledge
+ERROR_PREFIXES = ("⚠", "sorry, i couldn't", "ai response not available", "error:")
+
+
+def rejection_reason(question, answer, error_responses=(), min_question_chars=8, min_answer_chars=20):
+    """Why a Q&A pair should not be learned, or None if it is acceptable."""
+    answer = (answer or "").strip()
+    if len(normalize_question(question or "")) < min_question_chars:
+        return "question_too_short"
+    if not answer:
+        return "empty_answer"
+    if answer in error_responses or answer.casefold().startswith(ERROR_PREFIXES):
+        return "error_response"
+    if len(answer) < min_answer_chars:
+        return "answer_too_short"
+    return None
+
+
+class KnowledgeIngestor:
+    """Batches learned pairs into the knowledge base and keeps the index in step with it.
+
+    A question whose embedding is at least `merge_threshold` similar to a
+    stored question (or to one accepted earlier in the same batch) becomes
+    an alias of it instead of a new entry. Every `sync_interval` seconds the
+    index also picks up entries written by other worker processes.
+    """
+
+    def __init__(self, knowledge_base, index, encode, merge_threshold=0.9, error_responses=(),
+                 max_items=1000, sync_interval=30, router=None, hybrid=None):
+        self.knowledge_base = knowledge_base
+        self.index = index
+        self.router = router
+        self.hybrid = hybrid
+        self.encode = encode
+        self.merge_threshold = merge_threshold
+        self.error_responses = tuple(error_responses)
+        self.sync_interval = sync_interval
+        self.queue = WriteBehindQueue(self._ingest, max_items=max_items, max_batch=50, linger=0.5, name="kb-ingest")
+        self._syncer = None
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.merged = 0
+        self.duplicates = 0
+        self.rejected = {}
+
+    def start(self):
+        self.queue.start()
+        if self._syncer is None and self.sync_interval > 0:
+            def run():
+                while True:
+                    time.sleep(self.sync_interval)
+                    try:
+                        self.sync_index()
+                    except Exception as e:
+                        print(f"Embedding index sync error: {e}")
+
+            self._syncer = threading.Thread(target=run, name="kb-index-sync", daemon=True)
+            self._syncer.start()
+
+    def close(self, timeout=10):
+        self.queue.close(timeout)
+
+    def _reject(self, reason):
+        with self._lock:
+            self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+    def submit(self, question, answer):
+        """Queue a pair for learning; returns False if it was rejected or the queue is full."""
+        reason = rejection_reason(question, answer, self.error_responses)
+        if reason:
+            self._reject(reason)
+            return False
+        if not self.queue.submit((question, answer)):
+            self._reject("queue_full")
+            return False
+        return True
+
+    def sync_index(self):
+        """Bring the embedding index, router and lexical index up to date; returns the snapshot."""
+        data = self.knowledge_base.snapshot()
+        self.index.sync([q["question"] for q in data["queries"]], self.encode, version=data.get("version"))
+        for follower in (self.router, self.hybrid):
+            if follower is not None:
+                follower.sync(data["queries"], self.index)
+        return data
+
+    def _nearest_stored(self, vector, queries):
+        for row, score in self.index.top_k(vector, 1):
+            if score < self.merge_threshold or row >= len(queries) or row >= len(self.index.hashes):
+                continue
+            entry = queries[row]
+            if self.index.hashes[row] == question_hash(entry.get("question", "")):
+                return entry
+        return None
+
+    def _category_fields(self, vector):
+        category = self.router.predict(vector) if self.router is not None else None
+        return {"category": category} if category else {}
+
+    def _ingest(self, items):
+        queries = self.sync_index()["queries"]
+        vectors = normalize_rows(self.encode([question for question, _ in items]))
+        batch_questions, batch_vectors = [], []
+
+        for (question, answer), vector in zip(items, vectors):
+            canonical = self._nearest_stored(vector, queries)
+            if canonical is not None:
+                canonical_question = canonical["question"]
+            elif batch_vectors:
+                scores = np.vstack(batch_vectors) @ vector
+                best = int(np.argmax(scores))
+                canonical_question = batch_questions[best] if scores[best] >= self.merge_threshold else None
+            else:
+                canonical_question = None
+
+            if canonical_question is not None:
+                if self.knowledge_base.add_alias(canonical_question, question):
+                    self.merged += 1
+                else:
+                    self.duplicates += 1
+            elif self.knowledge_base.add(question, answer, **self._category_fields(vector)) is not None:
+                self.accepted += 1
+                batch_questions.append(question)
+                batch_vectors.append(vector)
+            else:
+                self.duplicates += 1
+
+        self.sync_index()
+
+    def stats(self):
+        with self._lock:
+            rejected = dict(self.rejected)
+        return {
+            "accepted": self.accepted,
+            "merged": self.merged,
+            "duplicates": self.duplicates,
+            "rejected": rejected,
+            "queue": self.queue.stats()
+        }
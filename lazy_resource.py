@@ -0,0 +1,91 @@
+"""Lazily built, thread-safe process resources and startup timing.
+
+Models and network clients are wrapped in `LazyResource` so importing the
+app stays cheap: the first caller builds the value under a lock and later
+callers read it without locking. A resource that owns sockets or native
+thread pools (gRPC channels, ONNX Runtime sessions) sets `reset_after_fork`
+so a forked worker builds its own copy instead of using the parent's.
+"""
+import os
+import threading
+import time
+
+
+class StartupTimer:
+    """Wall-clock time of each startup phase, measured between `mark` calls."""
+
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self._last = self.started
+        self.phases = {}
+        self.resources = {}
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def total(self):
+        return self._last - self.started
+
+    def summary(self):
+        phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
+        return f"Startup took {self.total():.2f}s ({phases})"
+
+    def stats(self):
+        return {
+            "pid": os.getpid(),
+            "total_seconds": self.total(),
+            "phases": dict(self.phases),
+            "resources": {name: resource.stats() for name, resource in self.resources.items()}
+        }
+
+
+class LazyResource:
+    """A value built by `factory` on first `get`, once per process."""
+
+    def __init__(self, name, factory, reset_after_fork=False, timer=None):
+        self.name = name
+        self.factory = factory
+        self.reset_after_fork = reset_after_fork
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.seconds = None
+        self.pid = None
+        if timer is not None:
+            timer.resources[name] = self
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def get(self):
+        if self._loaded:
+            return self._value
+        with self._lock:
+            if not self._loaded:
+                started = time.perf_counter()
+                self._value = self.factory()
+                self.seconds = time.perf_counter() - started
+                self.pid = os.getpid()
+                self._loaded = True
+                print(f"Loaded {self.name} in {self.seconds:.2f}s (pid {self.pid})")
+        return self._value
+
+    def _after_fork(self):
+        # Another thread may have held the lock when the process forked
+        self._lock = threading.Lock()
+        if self.reset_after_fork:
+            self._value = None
+            self._loaded = False
+
+    def stats(self):
+        return {
+            "loaded": self._loaded,
+            "load_seconds": self.seconds,
+            # Differs from the current pid when a preloading parent loaded it and this worker shares it
+            "loaded_by_pid": self.pid
+        }
@@ -0,0 +1,299 @@
+"""Pooled, retrying HTTP client for the Together AI chat-completions endpoint."""
+import asyncio
+import json
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+_STREAM_DONE = object()
+
+
+class LLMError(Exception):
+    """The upstream model could not produce a completion."""
+
+
+class CircuitOpenError(LLMError):
+    """Calls are short-circuited because the upstream keeps failing."""
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures.
+
+    While open every call fails fast. After `reset_timeout` seconds a single
+    trial call is let through; its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+
+class LLMClient:
+    """Shares one keep-alive session across requests and retries transient errors.
+
+    Retries use capped exponential backoff with full jitter and honour a
+    Retry-After header on 429/503. Exhausted retries count against the
+    circuit breaker.
+    """
+
+    def __init__(self, url, api_key, pool_size=10, connect_timeout=3.05, read_timeout=60,
+                 max_retries=3, backoff_base=0.5, backoff_max=8.0, breaker=None, async_pool_size=100):
+        self.url = url
+        self.api_key = api_key
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.async_pool_size = async_pool_size
+        self._async_session = None
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+
+    def _headers(self):
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _retry_or_raise(self, response):
+        """Classify a response: return an error to retry on, raise on client errors, None on success."""
+        if response.status_code in RETRY_STATUSES:
+            return LLMError(f"Together AI returned HTTP {response.status_code}")
+        if response.status_code >= 400:
+            # Client errors will not succeed on retry and do not mean the upstream is down
+            self.breaker.record_success()
+            raise LLMError(f"Together AI returned HTTP {response.status_code}")
+        self.breaker.record_success()
+        return None
+
+    def post(self, payload, stream=False):
+        """POST `payload` and return the successful response, retrying transient failures."""
+        if not self.breaker.allow():
+            raise CircuitOpenError("Together AI circuit is open")
+
+        self.calls += 1
+        last_error = None
+        settled = False
+        try:
+            for attempt in range(self.max_retries + 1):
+                retry_after = None
+                try:
+                    response = self.session.post(
+                        self.url, headers=self._headers(), json=payload, timeout=self.timeout, stream=stream
+                    )
+                except requests.RequestException as e:
+                    last_error = e
+                else:
+                    try:
+                        last_error = self._retry_or_raise(response)
+                    except LLMError:
+                        settled = True
+                        response.close()
+                        raise
+                    if last_error is None:
+                        settled = True
+                        return response
+                    retry_after = response.headers.get("Retry-After")
+                    response.close()
+
+                if attempt < self.max_retries:
+                    self.retries += 1
+                    time.sleep(self._backoff(attempt, retry_after))
+        finally:
+            # Any other way out still counts, so a half-open trial never stays in flight
+            if not settled:
+                self.failures += 1
+                self.breaker.record_failure()
+        raise LLMError(str(last_error))
+
+    def complete(self, payload):
+        """Return the decoded JSON body of a non-streaming completion."""
+        response = self.post(payload)
+        try:
+            return response.json()
+        except ValueError as e:
+            raise LLMError(f"Invalid JSON from Together AI: {e}")
+
+    @staticmethod
+    def _parse_stream_line(line):
+        """Return the content delta carried by one upstream SSE line, if any."""
+        if not line or not line.startswith("data:"):
+            return None
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return _STREAM_DONE
+        try:
+            chunk = json.loads(data)
+        except ValueError:
+            return None
+        choices = chunk.get("choices") or [{}]
+        delta = choices[0].get("delta") or {}
+        return delta.get("content") or choices[0].get("text")
+
+    def stream(self, payload):
+        """Yield content deltas from a `stream: true` completion.
+
+        Retries only cover establishing the stream; a failure after the first
+        token raises LLMError so the caller can decide what to keep.
+        """
+        response = self.post({**payload, "stream": True}, stream=True)
+        # Without a charset in Content-Type requests would hand back raw bytes
+        response.encoding = response.encoding or "utf-8"
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                content = self._parse_stream_line(line)
+                if content is _STREAM_DONE:
+                    break
+                if content:
+                    yield content
+        except requests.RequestException as e:
+            self.failures += 1
+            self.breaker.record_failure()
+            raise LLMError(f"Together AI stream interrupted: {e}")
+        finally:
+            response.close()
+
+    # Async variants for the ASGI serving mode; they share the breaker and counters
+
+    def _async_http(self):
+        if self._async_session is None:
+            import httpx
+
+            self._async_session = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+                limits=httpx.Limits(
+                    max_connections=self.async_pool_size,
+                    max_keepalive_connections=self.async_pool_size
+                )
+            )
+        return self._async_session
+
+    async def apost(self, payload, stream=False):
+        """Async counterpart of `post`, returning an httpx response."""
+        import httpx
+
+        if not self.breaker.allow():
+            raise CircuitOpenError("Together AI circuit is open")
+
+        client = self._async_http()
+        self.calls += 1
+        last_error = None
+        settled = False
+        try:
+            for attempt in range(self.max_retries + 1):
+                retry_after = None
+                try:
+                    request = client.build_request("POST", self.url, headers=self._headers(), json=payload)
+                    response = await client.send(request, stream=stream)
+                except httpx.HTTPError as e:
+                    last_error = e
+                else:
+                    try:
+                        last_error = self._retry_or_raise(response)
+                    except LLMError:
+                        settled = True
+                        await response.aclose()
+                        raise
+                    if last_error is None:
+                        settled = True
+                        return response
+                    retry_after = response.headers.get("Retry-After")
+                    await response.aclose()
+
+                if attempt < self.max_retries:
+                    self.retries += 1
+                    await asyncio.sleep(self._backoff(attempt, retry_after))
+        finally:
+            # Cancellation or an unexpected error must not leave a half-open trial in flight
+            if not settled:
+                self.failures += 1
+                self.breaker.record_failure()
+        raise LLMError(str(last_error))
+
+    async def acomplete(self, payload):
+        """Async counterpart of `complete`."""
+        response = await self.apost(payload)
+        try:
+            return response.json()
+        except ValueError as e:
+            raise LLMError(f"Invalid JSON from Together AI: {e}")
+
+    async def astream(self, payload):
+        """Async counterpart of `stream`."""
+        import httpx
+
+        response = await self.apost({**payload, "stream": True}, stream=True)
+        try:
+            async for line in response.aiter_lines():
+                content = self._parse_stream_line(line)
+                if content is _STREAM_DONE:
+                    break
+                if content:
+                    yield content
+        except httpx.HTTPError as e:
+            self.failures += 1
+            self.breaker.record_failure()
+            raise LLMError(f"Together AI stream interrupted: {e}")
+        finally:
+            await response.aclose()
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "circuit": self.breaker.state
+        }
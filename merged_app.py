@@ -1,24 +1,47 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+import time
+_import_started = time.perf_counter()
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 import os
 import re
+import atexit
 import json
-import requests
 import uuid
-from werkzeug.utils import secure_filename
-import pytesseract
-from pdf2image import convert_from_path
-import PyPDF2
-from PIL import Image
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
-import firebase_admin
-from firebase_admin import credentials, firestore
+import threading
+from functools import lru_cache, wraps
+from firebase_admin import credentials
+from google.cloud import firestore as google_firestore
 import speech_recognition as sr
 from io import BytesIO
+from embedding_index import EmbeddingIndex, normalize_rows, question_hash
+from retrievers import create_retriever
+from response_cache import create_response_cache, make_key
+from llm_client import LLMClient, LLMError, CircuitBreaker
+from embedding_service import RemoteEncoder
+from embedding_backends import encoder_key, load_encoder
+from chat_store import ChatStore
+from write_behind import WriteBehindQueue
+from document_extraction import extract_text
+from document_index import DocumentIndex, chunk_text
+from conversation_context import ContextBuilder
+from extraction_cache import ExtractionCache, content_key
+from upload_jobs import UploadJobManager, TooManyJobs
+from knowledge_base import KnowledgeBase
+from knowledge_ingest import KnowledgeIngestor
+from intent_router import IntentRouter
+from hybrid_search import HybridRetriever, parse_weights
+from single_flight import SingleFlight
+from lazy_resource import LazyResource, StartupTimer
+from db_migrations import configure_sqlite, upgrade as upgrade_database
+
+# Phase timings of this process's startup; lazily loaded resources add their own
+startup = StartupTimer(started=_import_started)
+startup.mark("imports")
+# Under gunicorn with PRELOAD_APP=1 the master imports the app and loads the model once;
+# forked workers share its pages copy-on-write and start their own threads (see gunicorn.conf.py)
+PRELOAD_APP = os.getenv("PRELOAD_APP", "0") == "1"
 
 # Initialize Flask app
 app = Flask(__name__, static_folder='static')
@@ -28,8 +51,10 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = "uploads"
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-# Initialize SQLAlchemy
+# Initialize SQLAlchemy; SQLite runs in WAL mode so history writes don't block readers
 db = SQLAlchemy(app)
+with app.app_context():
+    configure_sqlite(db.engine)
 
 # # Initialize Firebase
 # cred = credentials.Certificate("firebase-credentials.json")
@@ -39,25 +64,151 @@ db = SQLAlchemy(app)
 # Initialize Firebase (Render secret file compatible)
 secret_path = "/etc/secrets/firebase-credentials.json"  # Must match secret file name in Render
 
-if os.path.exists(secret_path):
-    # Use Render secret file
-    cred = credentials.Certificate(secret_path)
-else:
-    # Use local file only for development (not in GitHub)
-    cred = credentials.Certificate("firebase-credentials.json")
+def connect_firestore():
+    """Firestore client for this process, created on the first chat history read or write."""
+    if os.path.exists(secret_path):
+        # Use Render secret file
+        cred = credentials.Certificate(secret_path)
+    else:
+        # Use local file only for development (not in GitHub)
+        cred = credentials.Certificate("firebase-credentials.json")
+    # Built directly rather than through firebase_admin's per-app cache, so a
+    # forked worker never reuses a gRPC channel opened by its parent
+    return google_firestore.Client(project=cred.project_id, credentials=cred.get_credential())
 
-firebase_admin.initialize_app(cred)
-firestore_db = firestore.client()
+firestore_db = LazyResource("firestore", connect_firestore, reset_after_fork=True, timer=startup)
+chat_store = ChatStore(
+    firestore_db.get,
+    recent_limit=int(os.getenv("CHAT_RECENT_MESSAGES", "20")),
+    cache_ttl=float(os.getenv("CHAT_SESSION_CACHE_TTL", "30"))
+)
 
 # API Configuration
 TOGETHER_AI_API_KEY = os.getenv("TOGETHER_API_KEY")
-TOGETHER_AI_URL = "https://api.together.xyz/v1/chat/completions"
+TOGETHER_AI_URL = os.getenv("TOGETHER_AI_URL", "https://api.together.xyz/v1/chat/completions")
+AI_UNAVAILABLE_MESSAGE = "Sorry, I couldn't generate a response at the moment."
+LLM_MODEL = "meta-llama/Llama-3.3-70B-Instruct-Turbo"
+
+# Shared keep-alive client with timeouts, retries and a circuit breaker
+llm_client = LLMClient(
+    TOGETHER_AI_URL,
+    TOGETHER_AI_API_KEY,
+    pool_size=int(os.getenv("LLM_POOL_SIZE", "10")),
+    connect_timeout=float(os.getenv("LLM_CONNECT_TIMEOUT", "3.05")),
+    read_timeout=float(os.getenv("LLM_READ_TIMEOUT", "60")),
+    max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.getenv("LLM_BREAKER_THRESHOLD", "5")),
+        reset_timeout=float(os.getenv("LLM_BREAKER_RESET", "30"))
+    )
+)
+
+# Cache of LLM answers; set RESPONSE_CACHE_BACKEND=sqlite to share it between workers
+response_cache = create_response_cache(
+    backend=os.getenv("RESPONSE_CACHE_BACKEND", "memory"),
+    path=os.getenv("RESPONSE_CACHE_PATH", "response_cache.db"),
+    max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "1000")),
+    ttl=int(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+)
+
+# Identical prompts asked at the same moment share one upstream call
+llm_flights = SingleFlight(wait_timeout=float(os.getenv("LLM_COALESCE_TIMEOUT", "120")))
+
+# Chat history sent with each request is capped at a token budget; older turns are summarized
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", "250"))
+context_builder = ContextBuilder(
+    lambda *args: summarize_conversation(*args),
+    max_tokens=CONTEXT_TOKEN_BUDGET,
+    summary_tokens=CONTEXT_SUMMARY_TOKENS
+)
+
+# Load NLP Model, or use the shared embedding service when one is configured
+# EMBEDDING_BACKEND is torch (sentence-transformers) or onnx (an export from embedding_backends.py,
+# int8-quantized unless EMBEDDING_ONNX_QUANTIZED=0); the service must be started with the same settings
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", 'all-mpnet-base-v2')
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_PATH = os.getenv("EMBEDDING_ONNX_PATH")
+EMBEDDING_ONNX_QUANTIZED = os.getenv("EMBEDDING_ONNX_QUANTIZED", "1") != "0"
+# Indexes are keyed by model and backend, so switching either re-embeds instead of mixing vectors
+EMBEDDING_INDEX_KEY = encoder_key(EMBEDDING_BACKEND, EMBEDDING_MODEL_NAME, EMBEDDING_ONNX_PATH, EMBEDDING_ONNX_QUANTIZED)
+EMBEDDING_SERVICE_SOCKET = os.getenv("EMBEDDING_SERVICE_SOCKET")
+
+def load_embedding_model():
+    if EMBEDDING_SERVICE_SOCKET:
+        authkey = os.getenv("EMBEDDING_SERVICE_AUTHKEY")
+        return RemoteEncoder(EMBEDDING_SERVICE_SOCKET, authkey=authkey.encode() if authkey else None)
+    return load_encoder(
+        EMBEDDING_BACKEND,
+        EMBEDDING_MODEL_NAME,
+        onnx_path=EMBEDDING_ONNX_PATH,
+        quantized=EMBEDDING_ONNX_QUANTIZED,
+        threads=int(os.getenv("EMBEDDING_THREADS", "0")) or None
+    )
+
+# Loaded on first use. PyTorch weights survive a fork and stay shared; service
+# connections and ONNX Runtime sessions (which own thread pools) are rebuilt per worker
+model = LazyResource(
+    "embedding_model",
+    load_embedding_model,
+    reset_after_fork=bool(EMBEDDING_SERVICE_SOCKET) or EMBEDDING_BACKEND == "onnx",
+    timer=startup
+)
 
-# Load NLP Model
-model = SentenceTransformer('all-mpnet-base-v2')
+def encode(sentences, **kwargs):
+    """Embed `sentences` with the configured model, loading it on first use."""
+    return model.get().encode(sentences, **kwargs)
 
-# Tesseract OCR Path
-pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+# Knowledge base (data.json) held in memory; learned answers go to a journal
+DATA_PATH = os.path.join(os.path.dirname(__file__), "data.json")
+KB_COMPACT_INTERVAL = int(os.getenv("KB_COMPACT_INTERVAL", "300"))
+knowledge_base = KnowledgeBase(DATA_PATH)
+
+# Precomputed question embeddings for data.json, refreshed incrementally
+# RETRIEVER_BACKEND selects nearest-neighbour search: exact, faiss or hnswlib
+EMBEDDING_INDEX_PATH = os.path.join(os.path.dirname(__file__), "data_embeddings.npz")
+RETRIEVER_BACKEND = os.getenv("RETRIEVER_BACKEND", "exact")
+RETRIEVER_OPTIONS = {"index_type": os.getenv("FAISS_INDEX_TYPE", "hnsw")} if RETRIEVER_BACKEND == "faiss" else {}
+SIMILARITY_THRESHOLD = 0.7
+KB_FALLBACK_THRESHOLD = float(os.getenv("KB_FALLBACK_THRESHOLD", "0.5"))
+# BM25 and fuzzy candidates reranked with embeddings; fused scores run lower than
+# raw cosine similarity, so they have their own cut-off
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") != "0"
+HYBRID_WEIGHTS = parse_weights(os.getenv("HYBRID_WEIGHTS", "0.6,0.25,0.15"))
+# Nearest embedding neighbours handed to the fusion step, however few results are wanted
+HYBRID_SEMANTIC_CANDIDATES = int(os.getenv("HYBRID_SEMANTIC_CANDIDATES", "5"))
+HYBRID_THRESHOLD = float(os.getenv("HYBRID_THRESHOLD", "0.6"))
+embedding_index = EmbeddingIndex(
+    EMBEDDING_INDEX_PATH,
+    EMBEDDING_INDEX_KEY,
+    retriever=create_retriever(RETRIEVER_BACKEND, **RETRIEVER_OPTIONS)
+)
+
+# Category centroids route each query to the few knowledge base partitions worth scanning
+intent_router = IntentRouter(search_categories=int(os.getenv("INTENT_SEARCH_CATEGORIES", "3")))
+hybrid_retriever = HybridRetriever(weights=HYBRID_WEIGHTS)
+
+# Learned answers are screened, de-duplicated and indexed off the request path
+KB_MERGE_THRESHOLD = float(os.getenv("KB_MERGE_THRESHOLD", "0.9"))
+knowledge_ingestor = KnowledgeIngestor(
+    knowledge_base,
+    embedding_index,
+    encode,
+    merge_threshold=KB_MERGE_THRESHOLD,
+    error_responses=(AI_UNAVAILABLE_MESSAGE, "AI response not available."),
+    sync_interval=int(os.getenv("KB_INDEX_SYNC_INTERVAL", "30")),
+    router=intent_router,
+    hybrid=hybrid_retriever
+)
+
+# Chunk embeddings of the documents uploaded to each chat session
+DOCUMENT_INDEX_DIR = os.getenv("DOCUMENT_INDEX_DIR", os.path.join(os.path.dirname(__file__), "document_index"))
+DOCUMENT_CHUNKS_PER_PROMPT = int(os.getenv("DOCUMENT_CHUNKS_PER_PROMPT", "4"))
+# Minimum cosine similarity of a chunk to a message; calibrate it with the
+# document_threshold that `benchmark_retrieval.py --documents` reports for the model
+DOCUMENT_MATCH_THRESHOLD = float(os.getenv("DOCUMENT_MATCH_THRESHOLD", "0.35"))
+document_index = DocumentIndex(DOCUMENT_INDEX_DIR, EMBEDDING_INDEX_KEY)
+startup.mark("knowledge_base")
 
 # Database Models
 class User(db.Model):
@@ -71,6 +222,9 @@ class User(db.Model):
     last_login = db.Column(db.DateTime)
 
 class ChatHistory(db.Model):
+    __table_args__ = (
+        db.Index('ix_chat_history_user_session_time', 'user_id', 'session_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
@@ -79,16 +233,41 @@ class ChatHistory(db.Model):
     intent = db.Column(db.String(50))
     session_id = db.Column(db.String(50))  # New field for session tracking
 
+class UploadJob(db.Model):
+    __table_args__ = (
+        # Per-user count of active jobs when a new upload is submitted
+        db.Index('ix_upload_job_user_status', 'user_id', 'status', 'created_at'),
+    )
+    id = db.Column(db.String(36), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    session_id = db.Column(db.String(50))
+    filename = db.Column(db.String(255))
+    instructions = db.Column(db.Text)
+    status = db.Column(db.String(20), default='queued')
+    extracted_text = db.Column(db.Text)
+    pages = db.Column(db.Text)  # JSON list of per-page extraction timings
+    pages_done = db.Column(db.Integer, default=0)
+    ai_response = db.Column(db.Text)
+    error = db.Column(db.String(500))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class LoginLog(db.Model):
+    __table_args__ = (
+        db.Index('ix_login_log_timestamp', 'timestamp'),  # latest logins on the admin page
+        db.Index('ix_login_log_user_time', 'user_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     ip_address = db.Column(db.String(50))
     success = db.Column(db.Boolean)
 
-def init_db():
+def bootstrap_db():
     with app.app_context():
         db.create_all()
+        # Indexes and columns added since an existing sigce.db was created (see db_migrations.py)
+        upgrade_database(db.engine)
         if not User.query.filter_by(email='admin@sigce.edu').first():
             admin = User(
                 name='Admin',
@@ -100,8 +279,84 @@ def init_db():
             db.session.add(admin)
             db.session.commit()
 
-# Initialize database
-init_db()
+# Tables and the admin account are created once per process, before the first request
+database = LazyResource("database", bootstrap_db, timer=startup)
+
+def init_db():
+    database.get()
+
+def uses_database(view):
+    """Bootstrap the database before a route that reads or writes it."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        init_db()
+        return view(*args, **kwargs)
+    return wrapper
+
+# Background writer for chat history (Firestore + SQL); CHAT_WRITE_BEHIND=0 writes inline
+CHAT_WRITE_BEHIND = os.getenv("CHAT_WRITE_BEHIND", "1") != "0"
+chat_history_writer = WriteBehindQueue(
+    lambda turns: persist_chat_turns(turns),
+    max_items=int(os.getenv("CHAT_WRITE_QUEUE_SIZE", "10000")),
+    name="chat-history-writer"
+)
+
+# Upload processing: OCR/PDF extraction in a process pool, analysis on threads
+UPLOAD_JOB_TIMEOUT = int(os.getenv("UPLOAD_JOB_TIMEOUT", "600"))
+# Extracted text of previously seen uploads, keyed by the SHA-256 of their bytes
+extraction_cache = ExtractionCache(
+    os.getenv("EXTRACTION_CACHE_DIR", os.path.join(app.config['UPLOAD_FOLDER'], "extracted")),
+    max_bytes=int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+)
+
+upload_jobs = UploadJobManager(
+    app,
+    db,
+    UploadJob,
+    lambda *args, **kwargs: extract_upload_text(*args, **kwargs),
+    lambda *args: analyze_uploaded_document(*args),
+    max_workers=int(os.getenv("UPLOAD_JOB_WORKERS", "2")),
+    per_user_limit=int(os.getenv("UPLOAD_JOBS_PER_USER", "2")),
+    job_timeout=UPLOAD_JOB_TIMEOUT
+)
+atexit.register(upload_jobs.shutdown)
+
+# Knowledge base embeddings, router and lexical index, brought up to date by the first search
+knowledge_index = LazyResource("knowledge_index", lambda: knowledge_ingestor.sync_index(), timer=startup)
+
+_worker_pid = None
+_worker_lock = threading.Lock()
+
+def start_worker():
+    """Per-process setup: background threads, and no connections shared with a parent process.
+
+    Runs with the first chat turn, or in each forked worker when a preloading
+    gunicorn master imported the app.
+    """
+    global _worker_pid
+    if _worker_pid == os.getpid():
+        return
+    with _worker_lock:
+        if _worker_pid == os.getpid():
+            return
+        if database.loaded:
+            # Pooled SQLite connections opened by the master must not be used by its children
+            with app.app_context():
+                db.engine.dispose(close=False)
+        knowledge_base.start_compactor(KB_COMPACT_INTERVAL)
+        atexit.register(knowledge_base.compact)
+        knowledge_ingestor.start()
+        atexit.register(knowledge_ingestor.close)
+        if CHAT_WRITE_BEHIND:
+            chat_history_writer.start()
+            atexit.register(chat_history_writer.close)
+        _worker_pid = os.getpid()
+
+def warm_up():
+    """Load the model weights, bootstrap the database and sync the knowledge base index now."""
+    init_db()
+    model.get()
+    knowledge_index.get()
 
 # Helper function for phone validation
 def validate_phone(phone):
@@ -136,6 +391,7 @@ def chatbot():
 ### -------- AUTHENTICATION API -------- ###
 
 @app.route('/api/login', methods=['POST'])
+@uses_database
 def api_login():
     data = request.get_json()
     
@@ -181,6 +437,7 @@ def api_login():
     })
 
 @app.route('/api/register', methods=['POST'])
+@uses_database
 def api_register():
     data = request.get_json()
     
@@ -227,6 +484,7 @@ def api_logout():
 ### -------- ADMIN API -------- ###
 
 @app.route('/api/admin/data')
+@uses_database
 def admin_data():
     if not session.get('is_admin'):
         return jsonify({'error': 'Unauthorized'}), 403
@@ -257,190 +515,364 @@ def admin_data():
         } for log in login_logs]
     })
 
+@app.route('/api/admin/metrics')
+def admin_metrics():
+    """Performance counters for this worker process."""
+    if not session.get('is_admin'):
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    return jsonify({
+        'knowledge_base': knowledge_base.stats(),
+        'knowledge_ingest': knowledge_ingestor.stats(),
+        'intent_router': intent_router.stats(),
+        'hybrid_retriever': hybrid_retriever.stats(),
+        'response_cache': response_cache.stats(),
+        'llm_client': llm_client.stats(),
+        'chat_store': chat_store.stats(),
+        'startup': startup.stats(),
+        'chat_history_writer': chat_history_writer.stats(),
+        'llm_single_flight': llm_flights.stats(),
+        'extraction_cache': extraction_cache.stats(),
+        'conversation_context': context_builder.stats()
+    })
+
 ### -------- CHATBOT FUNCTIONALITY -------- ###
 
-def save_chat_history(user_id, message, response, session_id=None):
-    """Save chat messages to both Firebase and SQL database with session support."""
-    user_doc_ref = firestore_db.collection('users').document(str(user_id))
-    
-    # Get or create user data in Firestore
-    user_data = user_doc_ref.get()
-    data = user_data.to_dict() if user_data.exists else {'chat_sessions': []}
-    
-    # Find or create the session
+def persist_chat_turns(turns):
+    """Write chat turns: one Firestore batch per session and one SQL bulk insert.
+
+    Sessions and the SQL rows fail independently. The parts that were not
+    written are returned as turns, so the history writer retries only those.
+    """
+    sessions = {}
+    for user_id, session_id, messages, _ in turns:
+        if messages:
+            sessions.setdefault((user_id, session_id), []).extend(messages)
+
+    remaining = []
+    for (user_id, session_id), messages in sessions.items():
+        try:
+            chat_store.write_messages(user_id, session_id, messages)
+        except Exception as e:
+            print(f"Chat history write error for session {session_id}: {e}")
+            remaining.append((user_id, session_id, messages, None))
+
+    rows = [row for _, _, _, row in turns if row]
+    if rows:
+        init_db()
+        with app.app_context():
+            try:
+                db.session.execute(db.insert(ChatHistory), rows)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Chat history SQL insert error: {e}")
+                remaining.extend((row['user_id'], row['session_id'], [], row) for row in rows)
+    return remaining
+
+def save_chat_history(user_id, message, response, session_id=None, intent=None):
+    """Save chat messages to both Firebase and SQL database with session support.
+
+    The turn is visible to the session cache immediately and written to
+    storage by the background writer, unless the queue is full or disabled.
+    """
     session_id = session_id or session.get('current_session')
-    current_session = None
-    
-    for s in data.get('chat_sessions', []):
-        if s.get('session_id') == session_id:
-            current_session = s
-            break
-    
-    if not current_session:
-        current_session = {
+    messages = chat_store.stage_turn(user_id, session_id, message, response)
+
+    row = None
+    if message and response:
+        row = {
+            'user_id': user_id,
+            'user_message': message,
+            'bot_response': response,
             'session_id': session_id,
-            'created_at': datetime.utcnow().isoformat(),
-            'history': []
+            'intent': intent,
+            'timestamp': datetime.utcnow()
         }
-        if 'chat_sessions' not in data:
-            data['chat_sessions'] = []
-        data['chat_sessions'].append(current_session)
-    
-    # Add the new messages
-    if message:
-        current_session['history'].append({'user': message})
-    if response:
-        current_session['history'].append({'bot': response})
-    
-    # Save to Firestore
-    user_doc_ref.set(data, merge=True)
-    
-    # Also save to SQL database
-    if message and response:
-        db.session.add(ChatHistory(
-            user_id=user_id,
-            user_message=message,
-            bot_response=response,
-            session_id=session_id
-        ))
-        db.session.commit()
 
-def load_data():
-    file_path = os.path.join(os.path.dirname(__file__), "data.json")
-    if not os.path.exists(file_path):
-        return {"queries": []}
-    try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        return {"queries": []}
+    turn = (user_id, session_id, messages, row)
+    start_worker()
+    if not (CHAT_WRITE_BEHIND and chat_history_writer.submit(turn)):
+        if persist_chat_turns([turn]):
+            print(f"Chat turn of session {session_id} was not fully saved")
 
-def save_data(data):
-    file_path = os.path.join(os.path.dirname(__file__), "data.json")
-    try:
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
-    except Exception as e:
-        print(f"Error saving JSON: {e}")
+def load_data():
+    """Return the knowledge base from memory (data.json plus learned entries)."""
+    return knowledge_base.snapshot()
 
 def format_response(text):
     text = re.sub(r'(\. )([A-Z])', r'.\n\2', text)
     return text.strip()
 
-def get_ai_response(user_message, chat_history):
-    """Get AI-generated response from Llama model."""
-    headers = {
-        "Authorization": f"Bearer {TOGETHER_AI_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    data = {
-        "model": "meta-llama/Llama-3.3-70B-Instruct-Turbo",
-        "messages": [{"role": "user", "content": msg["user"]} for msg in chat_history if "user" in msg] + [{"role": "user", "content": user_message}],
+def summarize_conversation(previous_summary, messages):
+    """Fold `messages` into the running summary of a conversation; None if the LLM fails."""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    prompt = (
+        "Update the summary of this student enquiry conversation. Keep names, programmes, "
+        "dates and open questions; answer with the summary only.\n\n"
+        f"Current summary: {previous_summary or '(none)'}\n\nNew messages:\n{transcript}"
+    )
+    try:
+        response_data = llm_client.complete({
+            "model": LLM_MODEL,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": CONTEXT_SUMMARY_TOKENS,
+            "temperature": 0.2
+        })
+        choices = response_data.get("choices", [])
+        if choices and "message" in choices[0]:
+            return (choices[0]["message"].get("content") or "").strip() or None
+        return None
+    except LLMError as e:
+        print(f"Conversation summary failed: {e}")
+        return None
+
+def build_ai_payload(user_message, chat_history, session_key=None):
+    """Chat-completions request body for the Llama model.
+
+    History is trimmed to CONTEXT_TOKEN_BUDGET; with a `session_key`
+    (user id, session id) older turns are kept as a rolling summary.
+    """
+    return {
+        "model": LLM_MODEL,
+        "messages": context_builder.build(chat_history, session_key) + [{"role": "user", "content": user_message}],
         "max_tokens": 800,
         "temperature": 0.7,
         "top_p": 0.9
     }
+
+def complete_ai_payload(data):
+    """One upstream completion for `data`, cached on success; raises LLMError."""
+    response_data = llm_client.complete(data)
+    choices = response_data.get("choices", [])
+    if choices and "message" in choices[0] and "content" in choices[0]["message"]:
+        answer = format_response(choices[0]["message"]["content"])
+        response_cache.set(data, answer)
+        return answer
+    return "AI response not available."
+
+def get_ai_response(user_message, chat_history, session_key=None):
+    """Get AI-generated response from Llama model.
+
+    Concurrent requests with the same normalized payload share one upstream call.
+    """
+    data = build_ai_payload(user_message, chat_history, session_key)
+    cached = response_cache.get(data)
+    if cached is not None:
+        return cached
     try:
-        response = requests.post(TOGETHER_AI_URL, headers=headers, json=data)
-        response.raise_for_status()
-        response_data = response.json()
-        choices = response_data.get("choices", [])
-        if choices and "message" in choices[0] and "content" in choices[0]["message"]:
-            return format_response(choices[0]["message"]["content"])
-        else:
-            return "AI response not available."
-    except requests.RequestException as e:
+        return llm_flights.do(make_key(data), lambda: complete_ai_payload(data))
+    except (LLMError, TimeoutError) as e:
         print(f"AI request failed: {e}")
-        return "Sorry, I couldn't generate a response at the moment."
+        return AI_UNAVAILABLE_MESSAGE
 
-def extract_text_from_image(image_path):
-    """Extract text from image using OCR."""
-    try:
-        image = Image.open(image_path)
-        return pytesseract.image_to_string(image)
-    except Exception as e:
-        print(f"Image processing error: {e}")
-        return ""
+def stream_ai_response(user_message, chat_history, session_key=None):
+    """Yield the AI response in pieces as the model generates it.
 
-def extract_text_from_pdf(pdf_path):
-    """Extract text from PDF file."""
-    text = ""
+    The formatted full answer is cached once the stream completes; a cached
+    answer is yielded in one piece. A request that arrives while the same
+    payload is already streaming waits for that answer and yields it whole.
+    """
+    data = build_ai_payload(user_message, chat_history, session_key)
+    cached = response_cache.get(data)
+    if cached is not None:
+        yield cached
+        return
+
+    key = make_key(data)
+    call, leader = llm_flights.join(key)
+    if not leader:
+        try:
+            answer = call.wait(llm_flights.wait_timeout)
+        except (LLMError, TimeoutError) as e:
+            print(f"AI stream failed: {e}")
+            return
+        if answer:
+            yield answer
+        return
+
+    parts = []
+    answer = None
     try:
-        with open(pdf_path, "rb") as f:
-            reader = PyPDF2.PdfReader(f)
-            for page in reader.pages:
-                text += page.extract_text() or ""
-        return text
-    except Exception as e:
-        print(f"PDF processing error: {e}")
-        return ""
+        for token in llm_client.stream(data):
+            parts.append(token)
+            yield token
+        if parts:
+            answer = format_response("".join(parts))
+            response_cache.set(data, answer)
+    except LLMError as e:
+        print(f"AI stream failed: {e}")
+    finally:
+        # Also runs when the client disconnects; followers then fall back on their own
+        llm_flights.finish(key, call, result=answer)
 
-def process_uploaded_file(file):
-    """Process uploaded file and return extracted text."""
-    filename = secure_filename(file.filename)
-    file_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-    file.save(file_path)
+def extract_upload_text(filename, data, executor=None, on_page=None):
+    """Text of an uploaded file, served from the extraction cache when the same bytes were seen before."""
+    key = content_key(filename, data)
+    cached = extraction_cache.get(key)
+    if cached is not None:
+        return cached
+    extracted_text = extract_text(filename, data, app.config['UPLOAD_FOLDER'], executor=executor, on_page=on_page)
+    if extracted_text:
+        extraction_cache.set(key, extracted_text)
+    return extracted_text
 
-    extracted_text = ""
+def format_document_excerpts(chunks):
+    """Render document chunks as labelled excerpts for a prompt."""
+    return "\n\n".join(f"[{c['filename']}, part {c['chunk'] + 1}]\n{c['text']}" for c in chunks)
+
+def search_session_documents(user_id, session_id, user_message):
+    """Chunks of documents uploaded to this session that are relevant to the message, as (chunk, score) pairs."""
+    if not session_id or not document_index.has_documents(user_id, session_id):
+        return []
     try:
-        if filename.lower().endswith((".png", ".jpg", ".jpeg")):
-            extracted_text = extract_text_from_image(file_path)
-        elif filename.lower().endswith(".pdf"):
-            extracted_text = extract_text_from_pdf(file_path)
-        elif filename.lower().endswith(".txt"):
-            with open(file_path, "r", encoding="utf-8") as f:
-                extracted_text = f.read()
+        results = document_index.search(
+            user_id,
+            session_id,
+            embed_query(user_message),
+            k=DOCUMENT_CHUNKS_PER_PROMPT,
+            min_score=DOCUMENT_MATCH_THRESHOLD
+        )
     except Exception as e:
-        print(f"File processing error: {e}")
+        print(f"Document search error: {e}")
+        return []
+    return results
+
+def with_document_context(user_message, document_context):
+    """The message sent to the LLM, prefixed with document excerpts when there are any."""
+    if not document_context:
+        return user_message
+    return (
+        "Use these excerpts from documents uploaded in this chat where they are relevant:\n\n"
+        f"{document_context}\n\nQuestion: {user_message}"
+    )
+
+def analyze_uploaded_document(user_id, session_id, filename, instructions, extracted_text):
+    """Run the LLM over an extracted document and record it in chat history.
+
+    The document is chunked into the session's document index and only the
+    chunks most relevant to the instructions are sent, in document order.
+    Later chat turns in the session retrieve from the same index.
+    """
+    if session_id:
+        document_index.add_document(user_id, session_id, filename, extracted_text, encode)
+        results = document_index.search(
+            user_id,
+            session_id,
+            encode([instructions])[0],
+            k=DOCUMENT_CHUNKS_PER_PROMPT,
+            filename=filename
+        )
+        chunks = sorted((chunk for chunk, _ in results), key=lambda c: c['chunk'])
+    else:
+        chunks = [{'filename': filename, 'chunk': i, 'text': text}
+                  for i, text in enumerate(chunk_text(extracted_text)[:DOCUMENT_CHUNKS_PER_PROMPT])]
+
+    prompt = f"{instructions}\n\nDocument excerpts:\n\n{format_document_excerpts(chunks)}"
+    ai_response = get_ai_response(prompt, [])
 
+    # Save the file processing to chat history
+    with app.app_context():
+        save_chat_history(
+            user_id,
+            f"[File Upload] {filename}. Instructions: {instructions}",
+            ai_response,
+            session_id
+        )
+    return ai_response
+
+@lru_cache(maxsize=2048)
+def embed_query(text):
+    """Embedding of a user message; cached so matching, routing and logging encode it once."""
+    return encode([text])[0]
+
+def classify_intent(user_message, matched_query=None):
+    """Category of a message: the matched entry's category, else the router's prediction.
+
+    A matched entry decides on its own, so exact text hits are never encoded.
+    """
+    if matched_query:
+        return matched_query.get("category")
     try:
-        os.remove(file_path)  # Clean up the uploaded file
-    except:
-        pass
+        return intent_router.predict(embed_query(user_message))
+    except Exception as e:
+        print(f"Intent classification error: {e}")
+        return None
 
-    return extracted_text.strip()
+def search_knowledge_base(user_question, data, k=5):
+    """Return the top-k stored entries as (entry, score) pairs, best first.
 
-def get_best_match_semantic(user_question, data):
-    """Find the best matching stored answer using NLP."""
+    Scores are fused hybrid scores when HYBRID_SEARCH is on, cosine similarities otherwise.
+    """
     if not data or "queries" not in data or not data["queries"]:
+        return []
+
+    # The index is maintained by knowledge_ingestor; rows it has not caught up with are skipped
+    knowledge_index.get()
+    queries = data["queries"]
+    hashes = embedding_index.hashes
+    user_embedding = embed_query(user_question)
+    hybrid = HYBRID_SEARCH and hybrid_retriever.ready
+    # Fusion can promote a paraphrase that is not the nearest neighbour, so it sees a few of them
+    semantic_k = max(k, HYBRID_SEMANTIC_CANDIDATES) if hybrid else k
+    # The router narrows an exact scan; an ANN backend already avoids scanning every row
+    if RETRIEVER_BACKEND == "exact" and intent_router.ready:
+        candidates = intent_router.search(user_embedding, semantic_k)
+    else:
+        candidates = embedding_index.top_k(user_embedding, semantic_k)
+    if hybrid:
+        candidates = hybrid_retriever.search(user_question, user_embedding, k, semantic_candidates=candidates)
+    return [
+        (queries[i], score) for i, score in candidates
+        if i < len(queries) and i < len(hashes) and hashes[i] == question_hash(queries[i]["question"])
+    ]
+
+def get_fallback_match(user_question, data):
+    """Closest stored answer under a looser threshold, used when the LLM is unavailable."""
+    try:
+        results = search_knowledge_base(user_question, data, k=1)
+        if results and results[0][1] > KB_FALLBACK_THRESHOLD:
+            return results[0][0]
+        return None
+    except Exception as e:
+        print(f"Fallback matching error: {e}")
         return None
 
+def get_best_match_semantic(user_question, data):
+    """Find the best matching stored answer using NLP."""
     try:
-        user_embedding = model.encode([user_question])
-        question_embeddings = model.encode([q["question"] for q in data["queries"]])
-        similarities = cosine_similarity(user_embedding, question_embeddings)[0]
-        best_match_index = np.argmax(similarities)
-        best_match_score = similarities[best_match_index]
-        return data["queries"][best_match_index] if best_match_score > 0.7 else None
+        results = search_knowledge_base(user_question, data, k=1)
+        if results and results[0][1] > (HYBRID_THRESHOLD if HYBRID_SEARCH else SIMILARITY_THRESHOLD):
+            return results[0][0]
+        return None
     except Exception as e:
         print(f"Semantic matching error: {e}")
         return None
 
+
+def get_session_history(user_id, session_id):
+    """Get the message history of one chat session from Firestore."""
+    return chat_store.get_history(user_id, session_id)
+
+def get_session_context(user_id, session_id):
+    """Recent messages of a session for the LLM prompt; one cached read per turn."""
+    return chat_store.get_recent_history(user_id, session_id)
+
+def list_chat_sessions(user_id):
+    """Session summaries for the sidebar, newest first."""
+    return [{
+        'id': s.get('session_id'),
+        'created_at': s.get('created_at'),
+        'preview': s.get('preview') or 'New Chat'
+    } for s in chat_store.list_sessions(user_id) if s.get('session_id')]
+
 @app.route('/api/chat/sessions', methods=['GET'])
 def get_chat_sessions():
     """Get all chat sessions for the current user."""
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    user_doc_ref = firestore_db.collection('users').document(str(session['user_id']))
-    user_data = user_doc_ref.get()
-    
-    if not user_data.exists:
-        return jsonify({'sessions': []})
-    
-    data = user_data.to_dict()
-    sessions = data.get('chat_sessions', [])
-    
-    # Sort sessions by creation date (newest first)
-    sessions.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-    
-    return jsonify({
-        'sessions': [{
-            'id': s.get('session_id'),
-            'created_at': s.get('created_at'),
-            'preview': s['history'][0]['user'] if s.get('history') and len(s['history']) > 0 and 'user' in s['history'][0] else 'New Chat'
-        } for s in sessions if s.get('session_id')]
-    })
+    return jsonify({'sessions': list_chat_sessions(session['user_id'])})
 
 @app.route('/api/chat/history', methods=['GET'])
 def get_chat_history():
@@ -452,18 +884,7 @@ def get_chat_history():
     if not session_id:
         return jsonify({'error': 'Session ID is required'}), 400
     
-    user_doc_ref = firestore_db.collection('users').document(str(session['user_id']))
-    user_data = user_doc_ref.get()
-    
-    if not user_data.exists:
-        return jsonify({'history': []})
-    
-    data = user_data.to_dict()
-    for s in data.get('chat_sessions', []):
-        if s.get('session_id') == session_id:
-            return jsonify({'history': s.get('history', [])})
-    
-    return jsonify({'history': []})
+    return jsonify({'history': get_session_history(session['user_id'], session_id)})
 
 @app.route('/api/chat/new', methods=['POST'])
 def new_chat_session():
@@ -475,23 +896,50 @@ def new_chat_session():
     session['current_session'] = new_session_id
     
     # Initialize the session in Firestore
-    user_doc_ref = firestore_db.collection('users').document(str(session['user_id']))
-    user_data = user_doc_ref.get()
-    data = user_data.to_dict() if user_data.exists else {'chat_sessions': []}
-    
-    if 'chat_sessions' not in data:
-        data['chat_sessions'] = []
-    
-    data['chat_sessions'].append({
-        'session_id': new_session_id,
-        'created_at': datetime.utcnow().isoformat(),
-        'history': []
-    })
-    
-    user_doc_ref.set(data, merge=True)
+    chat_store.create_session(session['user_id'], new_session_id)
     
     return jsonify({'success': True, 'session_id': new_session_id})
 
+def resolve_chat_message(user_id, session_id, user_message, stored_data):
+    """Where a message is answered from: returns (matched_query, document_context), at most one set.
+
+    An exact knowledge base hit always wins. Otherwise excerpts of the
+    session's documents are used only when the best chunk is closer to the
+    message than the semantic knowledge base match.
+    """
+    exact = knowledge_base.find_exact(user_message)
+    if exact:
+        return exact, None
+    matched_query = get_best_match_semantic(user_message, stored_data)
+    results = search_session_documents(user_id, session_id, user_message)
+    if not results:
+        return matched_query, None
+    if matched_query:
+        # Hybrid match scores are fused, so compare the entry's cosine similarity with the chunk's
+        query = normalize_rows(embed_query(user_message))[0]
+        entry_score = float(normalize_rows(embed_query(matched_query["question"]))[0] @ query)
+        if entry_score >= results[0][1]:
+            return matched_query, None
+    return None, format_document_excerpts(chunk for chunk, _ in results)
+
+def finish_chat_turn(user_id, session_id, user_message, response, matched_query, learn=True):
+    """Persist a completed turn and learn the answer if it came from the LLM.
+
+    Answers grounded in a user's own uploaded documents pass learn=False so
+    they stay out of the shared knowledge base.
+    """
+    # Save to both Firestore and SQL database
+    save_chat_history(user_id, user_message, response, session_id, intent=classify_intent(user_message, matched_query))
+
+    # Queue new Q&A for the knowledge base; the ingestor screens and de-duplicates it
+    if learn and not matched_query and response and user_message:
+        knowledge_ingestor.submit(user_message, response)
+
+def sse_event(payload, event=None):
+    """Encode one Server-Sent Events message."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     if 'user_id' not in session:
@@ -509,41 +957,92 @@ def chat():
         return jsonify({'error': 'No active chat session'}), 400
 
     # Get current session history from Firestore
-    user_doc_ref = firestore_db.collection('users').document(user_id)
-    user_data = user_doc_ref.get()
-    current_history = []
-    
-    if user_data.exists:
-        data = user_data.to_dict()
-        for s in data.get('chat_sessions', []):
-            if s.get('session_id') == session_id:
-                current_history = s.get('history', [])
-                break
-
-    # First check stored data.json (knowledge base)
+    current_history = get_session_context(user_id, session_id)
+
     stored_data = load_data()
-    matched_query = get_best_match_semantic(user_message, stored_data)
+    # Questions about a document uploaded in this session go to the LLM with its excerpts,
+    # unless the knowledge base has a closer answer
+    matched_query, document_context = resolve_chat_message(user_id, session_id, user_message, stored_data)
 
     if matched_query:
         response = format_response(matched_query["answer"])
     else:
-        response = get_ai_response(user_message, current_history)
+        response = get_ai_response(
+            with_document_context(user_message, document_context),
+            current_history,
+            session_key=(user_id, session_id)
+        )
+        if response == AI_UNAVAILABLE_MESSAGE:
+            # Upstream is failing or the circuit is open: answer from the knowledge base if we can
+            matched_query = get_fallback_match(user_message, stored_data)
+            if matched_query:
+                response = format_response(matched_query["answer"])
 
-    # Save to both Firestore and SQL database
-    save_chat_history(session['user_id'], user_message, response, session_id)
-
-    # Store new Q&A in knowledge base if needed
-    if not matched_query and response and user_message:
-        if "queries" not in stored_data:
-            stored_data["queries"] = []
-        stored_data["queries"].append({"question": user_message, "answer": response})
-        save_data(stored_data)
+    finish_chat_turn(session['user_id'], session_id, user_message, response, matched_query, learn=not document_context)
 
     return jsonify({'response': response})
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Streaming variant of /api/chat that relays tokens over Server-Sent Events."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    data = request.get_json()
+    user_id = session['user_id']
+    user_message = data.get("message", "").strip()
+    session_id = session.get('current_session')
+
+    if not user_message:
+        return jsonify({'response': 'No message received!'})
+
+    if not session_id:
+        return jsonify({'error': 'No active chat session'}), 400
+
+    current_history = get_session_context(user_id, session_id)
+    stored_data = load_data()
+    matched_query, document_context = resolve_chat_message(user_id, session_id, user_message, stored_data)
+
+    def generate():
+        nonlocal matched_query
+        if matched_query:
+            response = format_response(matched_query["answer"])
+            yield sse_event({'token': response})
+        else:
+            parts = []
+            prompt = with_document_context(user_message, document_context)
+            for token in stream_ai_response(prompt, current_history, session_key=(str(user_id), session_id)):
+                parts.append(token)
+                yield sse_event({'token': token})
+            response = format_response("".join(parts)) if parts else AI_UNAVAILABLE_MESSAGE
+            if not parts:
+                matched_query = get_fallback_match(user_message, stored_data)
+                if matched_query:
+                    response = format_response(matched_query["answer"])
+
+        finish_chat_turn(user_id, session_id, user_message, response, matched_query, learn=not document_context)
+        yield sse_event({'response': response}, event='done')
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def start_upload_job(user_id, session_id, filename, data, instructions):
+    """Queue an uploaded file for processing; returns (payload, status code)."""
+    if not session_id:
+        return {'error': 'No active chat session'}, 400
+    init_db()
+    try:
+        job_id = upload_jobs.submit(user_id, session_id, filename, data, instructions)
+    except TooManyJobs as e:
+        return {'error': str(e)}, 429
+    return {'job_id': job_id, 'status': 'queued'}, 202
+
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
-    """Upload & process files with instructions."""
+    """Upload a file with instructions; processing continues in the background."""
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
@@ -555,29 +1054,26 @@ def upload_file():
         return jsonify({"error": "No selected file!"}), 400
 
     instructions = request.form.get("instructions", "Analyze this document and summarize the key points.")
-    extracted_text = process_uploaded_file(file)
-
-    if not extracted_text:
-        return jsonify({"error": "No readable text found in file."}), 400
-
-    # Create a prompt combining the instructions and extracted text
-    prompt = f"{instructions}\n\nDocument content:\n{extracted_text}"
-    
-    # Get AI response based on the instructions
-    ai_response = get_ai_response(prompt, [{"user": prompt}])
-
-    # Save the file processing to chat history
-    save_chat_history(
+    payload, status = start_upload_job(
         session['user_id'],
-        f"[File Upload] {file.filename}. Instructions: {instructions}",
-        ai_response,
-        session.get('current_session')
+        session.get('current_session'),
+        file.filename,
+        file.read(),
+        instructions
     )
+    return jsonify(payload), status
 
-    return jsonify({
-        "extracted_text": extracted_text,
-        "ai_response": ai_response
-    })
+@app.route('/api/upload/<job_id>', methods=['GET'])
+@uses_database
+def upload_status(job_id):
+    """Status and, once finished, the result of an upload job."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    job = upload_jobs.get(job_id, session['user_id'])
+    if not job:
+        return jsonify({'error': 'Upload job not found'}), 404
+    return jsonify(job)
 
 @app.route('/api/voice', methods=['POST'])
 def voice_to_text():
@@ -605,5 +1101,10 @@ def voice_to_text():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+if PRELOAD_APP:
+    warm_up()
+    startup.mark("preload")
+print(startup.summary())
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
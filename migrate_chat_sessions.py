@@ -0,0 +1,155 @@
+"""Move chat history from the legacy users/{id}.chat_sessions array into subcollections.
+
+Usage:
+
+    python migrate_chat_sessions.py --credentials firebase-credentials.json [--dry-run] [--delete-legacy]
+
+Message ids are derived from the session's created_at and the message
+position, so running the migration again, or after the app has already
+written to a session, rewrites the same documents instead of duplicating
+them. Sessions that already have a document keep their recent messages
+and preview; only the legacy messages and message_count are added. Pass
+--delete-legacy once the new layout has been verified to drop the old
+array from each user document.
+"""
+import argparse
+from datetime import datetime
+
+import firebase_admin
+from firebase_admin import credentials, firestore
+
+from chat_store import ChatStore, message_doc_id
+
+# Firestore rejects batches with more than 500 writes
+BATCH_LIMIT = 500
+
+
+def _base_ts(created_at):
+    try:
+        return int(datetime.fromisoformat(created_at).timestamp() * 1_000_000_000)
+    except (TypeError, ValueError):
+        return 0
+
+
+class BatchWriter:
+    """Commit writes in chunks that stay under the Firestore batch limit."""
+
+    def __init__(self, client, dry_run=False):
+        self.client = client
+        self.dry_run = dry_run
+        self.batch = client.batch()
+        self.pending = 0
+        self.written = 0
+
+    def set(self, ref, data, merge=False):
+        self.batch.set(ref, data, merge=merge)
+        self._count()
+
+    def update(self, ref, data):
+        self.batch.update(ref, data)
+        self._count()
+
+    def _count(self):
+        self.pending += 1
+        if self.pending >= BATCH_LIMIT:
+            self.flush()
+
+    def flush(self):
+        if self.pending and not self.dry_run:
+            self.batch.commit()
+        self.written += self.pending
+        self.batch = self.client.batch()
+        self.pending = 0
+
+
+def migrate_user(store, writer, user_doc, delete_legacy=False):
+    """Copy the legacy sessions of one user into session documents.
+
+    A session the app has already created since the deploy gets the legacy
+    messages merged in, and its message_count is recomputed from the
+    message ids it ends up with. Returns (sessions, messages, merged) counts.
+    """
+    data = user_doc.to_dict() or {}
+    legacy_sessions = data.get('chat_sessions') or []
+    session_total = message_total = merged = 0
+
+    for legacy in legacy_sessions:
+        session_id = legacy.get('session_id')
+        if not session_id:
+            continue
+        created_at = legacy.get('created_at') or datetime.utcnow().isoformat()
+        history = legacy.get('history') or []
+        session_ref = store.session_ref(user_doc.id, session_id)
+        snapshot = session_ref.get()
+        messages_ref = session_ref.collection('messages')
+        message_ids = {ref.id for ref in messages_ref.list_documents()} if snapshot.exists else set()
+        base_ts = _base_ts(created_at)
+
+        preview = None
+        for position, message in enumerate(history):
+            role, content = next(iter(message.items()), ('user', ''))
+            if preview is None and role == 'user':
+                preview = content
+            ts = base_ts + position
+            message_ids.add(message_doc_id(ts))
+            writer.set(messages_ref.document(message_doc_id(ts)), {
+                'role': role,
+                'content': content,
+                'ts': ts,
+                'created_at': created_at
+            })
+
+        if snapshot.exists:
+            # Keep what the app wrote since the deploy; the legacy messages sort before it
+            fields = {'message_count': len(message_ids)}
+            if not (snapshot.to_dict() or {}).get('preview'):
+                fields['preview'] = preview
+            writer.set(session_ref, fields, merge=True)
+            merged += 1
+        else:
+            writer.set(session_ref, {
+                'session_id': session_id,
+                'created_at': created_at,
+                'updated_at': created_at,
+                'preview': preview,
+                'message_count': len(message_ids)
+            }, merge=True)
+        session_total += 1
+        message_total += len(history)
+
+    if delete_legacy and legacy_sessions:
+        writer.update(user_doc.reference, {'chat_sessions': firestore.DELETE_FIELD})
+    return session_total, message_total, merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate Firestore chat history to per-session documents")
+    parser.add_argument("--credentials", default="firebase-credentials.json")
+    parser.add_argument("--dry-run", action="store_true", help="Count what would be written without writing")
+    parser.add_argument("--delete-legacy", action="store_true", help="Remove the chat_sessions array afterwards")
+    args = parser.parse_args()
+
+    firebase_admin.initialize_app(credentials.Certificate(args.credentials))
+    client = firestore.client()
+    store = ChatStore(client)
+    writer = BatchWriter(client, dry_run=args.dry_run)
+
+    users = sessions = messages = merged = 0
+    for user_doc in client.collection('users').stream():
+        migrated_sessions, migrated_messages, merged_sessions = migrate_user(
+            store, writer, user_doc, args.delete_legacy
+        )
+        if migrated_sessions:
+            users += 1
+            sessions += migrated_sessions
+            messages += migrated_messages
+        merged += merged_sessions
+    writer.flush()
+
+    action = "Would write" if args.dry_run else "Wrote"
+    print(f"{action} {writer.written} documents: {users} users, {sessions} sessions, {messages} messages "
+          f"({merged} merged into existing sessions)")
+
+
+if __name__ == "__main__":
+    main()
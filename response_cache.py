@@ -0,0 +1,171 @@
+"""Bounded LRU/TTL cache for LLM answers.
+
+Keys hash the model name, sampling parameters and message list, so an
+identical prompt with identical history reuses the earlier answer. The
+memory backend is private to one worker; the SQLite backend is shared by
+every worker process on the host.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def _normalize_content(text):
+    return " ".join(str(text).split()).casefold()
+
+
+def make_key(payload):
+    """Hash a chat-completions payload, ignoring whitespace and case in message text."""
+    messages = [
+        {"role": m.get("role"), "content": _normalize_content(m.get("content", ""))}
+        for m in payload.get("messages", [])
+    ]
+    params = {k: v for k, v in payload.items() if k not in ("messages", "stream")}
+    raw = json.dumps({"params": params, "messages": messages}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class MemoryCacheBackend:
+    """In-process LRU with per-entry expiry."""
+
+    def __init__(self, max_entries=1000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCacheBackend:
+    """LRU/TTL cache in a SQLite file so gunicorn workers share answers."""
+
+    def __init__(self, path, max_entries=1000, ttl=3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        # Schema setup uses a throwaway connection, so a preloading parent keeps none open
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_response_cache_last_used ON response_cache (last_used)")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        # A connection inherited across fork is never reused by the child
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        try:
+            conn = self._conn()
+            now = time.time()
+            row = conn.execute(
+                "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            conn.execute("UPDATE response_cache SET last_used = ? WHERE key = ?", (now, key))
+            conn.commit()
+            return row[0]
+        except sqlite3.Error as e:
+            print(f"Response cache read error: {e}")
+            return None
+
+    def set(self, key, value):
+        try:
+            conn = self._conn()
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, now + self.ttl, now),
+            )
+            conn.execute("DELETE FROM response_cache WHERE expires_at < ?", (now,))
+            conn.execute(
+                "DELETE FROM response_cache WHERE key IN ("
+                "SELECT key FROM response_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Response cache write error: {e}")
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+
+class ResponseCache:
+    """Front end over a backend that also counts hits and misses."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, payload):
+        value = self.backend.get(make_key(payload))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, payload, value):
+        self.backend.set(make_key(payload), value)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def create_response_cache(backend="memory", path="response_cache.db", max_entries=1000, ttl=3600):
+    """Build a cache from configuration values."""
+    if backend == "sqlite":
+        return ResponseCache(SQLiteCacheBackend(path, max_entries=max_entries, ttl=ttl))
+    return ResponseCache(MemoryCacheBackend(max_entries=max_entries, ttl=ttl))
@@ -0,0 +1,177 @@
+"""Nearest-neighbour backends for the knowledge base embedding index.
+
+Every backend works on unit-length float32 vectors and scores by inner
+product, which equals cosine similarity for normalized embeddings.
+"""
+import numpy as np
+
+
+class Retriever:
+    """Interface shared by all backends."""
+
+    name = "base"
+
+    def __init__(self):
+        self.size = 0
+        self.dim = 0
+
+    def build(self, vectors):
+        """Replace the indexed vectors."""
+        raise NotImplementedError
+
+    def add(self, vectors):
+        """Append vectors; their row numbers continue from the current size."""
+        raise NotImplementedError
+
+    def search(self, query, k=1):
+        """Return up to `k` (row, score) pairs, best first."""
+        raise NotImplementedError
+
+
+class ExactRetriever(Retriever):
+    """Brute-force matrix-vector product in NumPy."""
+
+    name = "exact"
+
+    def __init__(self):
+        super().__init__()
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+
+    def build(self, vectors):
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.size, self.dim = self.vectors.shape if self.vectors.size else (0, 0)
+
+    def add(self, vectors):
+        if not self.size:
+            return self.build(vectors)
+        self.build(np.vstack([self.vectors, vectors]))
+
+    def search(self, query, k=1):
+        if not self.size:
+            return []
+        scores = self.vectors @ np.asarray(query, dtype=np.float32)
+        k = min(k, self.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+
+class FaissRetriever(Retriever):
+    """Approximate search with a FAISS HNSW or IVF index."""
+
+    name = "faiss"
+
+    def __init__(self, index_type="hnsw", hnsw_m=32, ef_search=64, nlist=100, nprobe=8):
+        super().__init__()
+        import faiss
+
+        self.faiss = faiss
+        self.index_type = index_type
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.index = None
+
+    def _new_index(self, vectors):
+        faiss = self.faiss
+        if self.index_type == "ivf":
+            # IVF needs training data; fall back to a flat index for tiny stores
+            nlist = min(self.nlist, max(1, len(vectors) // 39))
+            quantizer = faiss.IndexFlatIP(self.dim)
+            index = faiss.IndexIVFFlat(quantizer, self.dim, nlist, faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+            index.nprobe = min(self.nprobe, nlist)
+            return index
+        index = faiss.IndexHNSWFlat(self.dim, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efSearch = self.ef_search
+        return index
+
+    def build(self, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if not vectors.size:
+            self.index, self.size, self.dim = None, 0, 0
+            return
+        self.size, self.dim = vectors.shape
+        self.index = self._new_index(vectors)
+        self.index.add(vectors)
+
+    def add(self, vectors):
+        if self.index is None:
+            return self.build(vectors)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.index.add(vectors)
+        self.size += len(vectors)
+
+    def search(self, query, k=1):
+        if self.index is None:
+            return []
+        query = np.ascontiguousarray(query, dtype=np.float32).reshape(1, -1)
+        scores, rows = self.index.search(query, min(k, self.size))
+        return [(int(i), float(s)) for i, s in zip(rows[0], scores[0]) if i >= 0]
+
+
+class HnswlibRetriever(Retriever):
+    """Approximate search with hnswlib (installed with chromadb as chroma-hnswlib)."""
+
+    name = "hnswlib"
+
+    def __init__(self, hnsw_m=32, ef_construction=200, ef_search=64):
+        super().__init__()
+        import hnswlib
+
+        self.hnswlib = hnswlib
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.index = None
+
+    def build(self, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if not vectors.size:
+            self.index, self.size, self.dim = None, 0, 0
+            return
+        self.size, self.dim = vectors.shape
+        self.index = self.hnswlib.Index(space="ip", dim=self.dim)
+        self.index.init_index(max_elements=max(1024, self.size * 2), ef_construction=self.ef_construction, M=self.hnsw_m)
+        self.index.set_ef(self.ef_search)
+        self.index.add_items(vectors, np.arange(self.size))
+
+    def add(self, vectors):
+        if self.index is None:
+            return self.build(vectors)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        needed = self.size + len(vectors)
+        if needed > self.index.get_max_elements():
+            self.index.resize_index(needed * 2)
+        self.index.add_items(vectors, np.arange(self.size, needed))
+        self.size = needed
+
+    def search(self, query, k=1):
+        if self.index is None:
+            return []
+        k = min(k, self.size)
+        self.index.set_ef(max(self.ef_search, k))
+        rows, distances = self.index.knn_query(np.asarray(query, dtype=np.float32), k=k)
+        # hnswlib reports inner-product distance as 1 - similarity
+        return [(int(i), float(1.0 - d)) for i, d in zip(rows[0], distances[0])]
+
+
+RETRIEVERS = {
+    "exact": ExactRetriever,
+    "faiss": FaissRetriever,
+    "hnswlib": HnswlibRetriever,
+}
+
+
+def create_retriever(backend="exact", **options):
+    """Instantiate a backend by name, falling back to exact search if it cannot load."""
+    cls = RETRIEVERS.get(backend)
+    if cls is None:
+        print(f"Unknown retriever backend '{backend}', using exact search")
+        return ExactRetriever()
+    try:
+        return cls(**options)
+    except ImportError as e:
+        print(f"Retriever backend '{backend}' unavailable ({e}), using exact search")
+        return ExactRetriever()
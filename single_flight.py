@@ -0,0 +1,109 @@
+"""Single-flight coalescing of identical concurrent calls.
+
+The first caller for a key becomes the leader and does the work; callers
+that arrive while it is in flight wait for the leader's result instead of
+repeating the call. Followers can wait from threads or from an event loop.
+"""
+import asyncio
+import threading
+
+
+class _Call:
+    """One in-flight call and the result its followers are waiting for."""
+
+    def __init__(self):
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._futures = []
+
+    def _resolve(self, result, error):
+        with self._lock:
+            self.result = result
+            self.error = error
+            self._done.set()
+            futures, self._futures = self._futures, []
+        for loop, future in futures:
+            loop.call_soon_threadsafe(_set_done, future)
+
+    def _outcome(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def wait(self, timeout=None):
+        """Block until the leader finishes; raises TimeoutError if it takes too long."""
+        if not self._done.wait(timeout):
+            raise TimeoutError("single-flight leader did not finish in time")
+        return self._outcome()
+
+    async def wait_async(self, timeout=None):
+        """Await the leader's result without tying up a thread."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if self._done.is_set():
+                future.set_result(None)
+            else:
+                self._futures.append((loop, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("single-flight leader did not finish in time")
+        return self._outcome()
+
+
+def _set_done(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class SingleFlight:
+    """Tracks in-flight calls by key and counts how many requests were collapsed."""
+
+    def __init__(self, wait_timeout=120):
+        self.wait_timeout = wait_timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.collapsed = 0
+
+    def join(self, key):
+        """Return (call, is_leader). The leader must hand its outcome to `finish`."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.collapsed += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            self.leaders += 1
+            return call, True
+
+    def finish(self, key, call, result=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call._resolve(result, error)
+
+    def do(self, key, fn):
+        """Run `fn()` once for all concurrent callers with the same key."""
+        call, leader = self.join(key)
+        if not leader:
+            return call.wait(self.wait_timeout)
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, call, error=e)
+            raise
+        self.finish(key, call, result=result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._calls)
+        return {
+            "in_flight": in_flight,
+            "leaders": self.leaders,
+            "collapsed": self.collapsed
+        }
@@ -262,18 +262,22 @@ document.addEventListener("DOMContentLoaded", function () {
         document.getElementById('chat-box').appendChild(typingIndicator);
         document.getElementById('chat-box').scrollTop = document.getElementById('chat-box').scrollHeight;
 
-        // Send to server
-        fetch('/api/chat', {
+        // Send to server and render tokens as they stream in
+        fetch('/api/chat/stream', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ message: message })
         })
-        .then(response => response.json())
-        .then(data => {
+        .then(response => {
+            if (!response.ok || !response.body) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            return readChatStream(response.body.getReader());
+        })
+        .then(finalText => {
             document.querySelectorAll('.typing-indicator').forEach(ind => ind.remove());
-            
-            if (data.response) {
-                appendMessage(formatResponse(data.response), 'bot');
+
+            if (finalText) {
                 fetchChatSessions(); // Refresh session list
             } else {
                 appendMessage("⚠ Error: Could not fetch response.", 'bot');
@@ -286,6 +290,64 @@ document.addEventListener("DOMContentLoaded", function () {
         });
     }
 
+    // Read Server-Sent Events from /api/chat/stream, growing one bot message
+    function readChatStream(reader) {
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let text = '';
+        let finalText = '';
+        let messageSpan = null;
+
+        function render(content) {
+            if (!messageSpan) {
+                document.querySelectorAll('.typing-indicator').forEach(ind => ind.remove());
+                messageSpan = appendMessage('', 'bot');
+            }
+            messageSpan.innerHTML = formatResponse(content);
+            const chatBox = document.getElementById('chat-box');
+            chatBox.scrollTop = chatBox.scrollHeight;
+        }
+
+        function handleEvent(rawEvent) {
+            let eventName = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event:')) {
+                    eventName = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    data += line.slice(5).trim();
+                }
+            });
+            if (!data) {
+                return;
+            }
+            const payload = JSON.parse(data);
+            if (eventName === 'done') {
+                finalText = payload.response || text;
+                render(finalText);
+            } else if (payload.token) {
+                text += payload.token;
+                render(text);
+            }
+        }
+
+        function pump() {
+            return reader.read().then(({ done, value }) => {
+                if (value) {
+                    buffer += decoder.decode(value, { stream: true });
+                    let boundary;
+                    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                        handleEvent(buffer.slice(0, boundary));
+                        buffer = buffer.slice(boundary + 2);
+                    }
+                }
+                return done ? (finalText || text) : pump();
+            });
+        }
+
+        return pump();
+    }
+
     function formatResponse(response) {
         return response
             .replace(/\\(.+?)\\/g, '🔹 $1')     // \text\ → 🔹 text
@@ -306,6 +368,7 @@ document.addEventListener("DOMContentLoaded", function () {
         messageDiv.appendChild(messageContent);
         chatBox.appendChild(messageDiv);
         chatBox.scrollTop = chatBox.scrollHeight;
+        return messageContent;
     }
 
     // Handle file upload
@@ -331,13 +394,16 @@ document.addEventListener("DOMContentLoaded", function () {
         })
         .then(response => response.json())
         .then(data => {
-            loadingIndicator.style.display = 'none';
-            if (data.ai_response) {
-                appendMessage(`📄 Analysis: ${data.ai_response}`, 'bot');
-            } else if (data.error) {
-                appendMessage(`⚠ ${data.error}`, 'bot');
+            if (data.job_id) {
+                // Only the ASGI server offers an event stream; otherwise poll the job status
+                if (data.events_url) {
+                    watchUploadJob(data.job_id, data.events_url);
+                } else {
+                    pollUploadJob(data.job_id);
+                }
             } else {
-                appendMessage("⚠ Unexpected response from server", 'bot');
+                loadingIndicator.style.display = 'none';
+                appendMessage(`⚠ ${data.error || "Unexpected response from server"}`, 'bot');
             }
         })
         .catch(error => {
@@ -349,6 +415,56 @@ document.addEventListener("DOMContentLoaded", function () {
         fileUpload.value = "";
     }
 
+    // Show the result of a finished upload job; returns false while it is still running
+    function finishUploadJob(job) {
+        if (job.status !== 'done' && job.status !== 'failed') {
+            return false;
+        }
+        loadingIndicator.style.display = 'none';
+        if (job.status === 'done') {
+            appendMessage(`📄 Analysis: ${job.ai_response}`, 'bot');
+            fetchChatSessions();
+        } else {
+            appendMessage(`⚠ ${job.error || "Could not process the file."}`, 'bot');
+        }
+        return true;
+    }
+
+    // Check an upload job's status until its analysis is ready
+    function pollUploadJob(jobId) {
+        fetch(`/api/upload/${jobId}`)
+        .then(response => response.json())
+        .then(job => {
+            if (!job.status) {
+                loadingIndicator.style.display = 'none';
+                appendMessage(`⚠ ${job.error || "Lost track of the upload. Please try again."}`, 'bot');
+            } else if (!finishUploadJob(job)) {
+                setTimeout(() => pollUploadJob(jobId), 2000);
+            }
+        })
+        .catch(() => {
+            loadingIndicator.style.display = 'none';
+            appendMessage("⚠ Lost track of the upload. Please try again.", 'bot');
+        });
+    }
+
+    // Follow an upload job's event stream until its analysis is ready
+    function watchUploadJob(jobId, eventsUrl) {
+        const events = new EventSource(eventsUrl);
+
+        events.addEventListener('status', event => {
+            if (finishUploadJob(JSON.parse(event.data))) {
+                events.close();
+            }
+        });
+
+        events.onerror = () => {
+            events.close();
+            // The stream can drop behind proxies; fall back to polling
+            pollUploadJob(jobId);
+        };
+    }
+
     // Toggle speech recognition
     function toggleSpeechRecognition() {
         if (isRecognizing) {
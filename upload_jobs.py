@@ -0,0 +1,132 @@
+"""Background jobs for /api/upload.
+
+Text extraction (OCR, PDF parsing) is CPU-bound and runs in a process pool;
+PDFs are split into page ranges that are extracted in parallel, and the
+number of pages done is recorded as they arrive; the text and page timings
+are written once extraction finishes. The LLM analysis that follows is
+I/O-bound and runs on a thread pool. Job
+state lives in the UploadJob table, so any worker process can answer a
+status request.
+"""
+import json
+import multiprocessing
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+ACTIVE_STATUSES = ('queued', 'extracting', 'analyzing')
+FINISHED_STATUSES = ('done', 'failed')
+
+
+class TooManyJobs(Exception):
+    """The user already has the maximum number of uploads in progress."""
+
+
+def job_to_dict(job):
+    return {
+        'job_id': job.id,
+        'status': job.status,
+        'filename': job.filename,
+        'extracted_text': job.extracted_text,
+        'pages': json.loads(job.pages) if job.pages else [],
+        'pages_done': job.pages_done or 0,
+        'ai_response': job.ai_response,
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'updated_at': job.updated_at.isoformat() if job.updated_at else None
+    }
+
+
+class UploadJobManager:
+    """Queues uploads, enforces a per-user concurrency limit and records progress."""
+
+    def __init__(self, app, db, model, extract_fn, analyze_fn, max_workers=2, max_threads=8,
+                 per_user_limit=2, job_timeout=600):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.extract_fn = extract_fn
+        self.analyze_fn = analyze_fn
+        self.max_workers = max_workers
+        self.per_user_limit = per_user_limit
+        self.job_timeout = job_timeout
+        self._threads = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="upload-job")
+        self._process_pool = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # forkserver children start from a clean process instead of a copy of a
+        # worker that already runs gRPC and model threads
+        with self._lock:
+            if self._process_pool is None:
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                self._process_pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+            return self._process_pool
+
+    def submit(self, user_id, session_id, filename, data, instructions):
+        """Record a new job and start it; returns the job id."""
+        job_id = str(uuid.uuid4())
+        with self._lock, self.app.app_context():
+            # Jobs older than the timeout are treated as abandoned (e.g. their worker restarted)
+            cutoff = datetime.utcnow() - timedelta(seconds=self.job_timeout)
+            active = self.model.query.filter(
+                self.model.user_id == user_id,
+                self.model.status.in_(ACTIVE_STATUSES),
+                self.model.created_at >= cutoff
+            ).count()
+            if active >= self.per_user_limit:
+                raise TooManyJobs(f"At most {self.per_user_limit} uploads can be processed at once")
+
+            self.db.session.add(self.model(
+                id=job_id,
+                user_id=user_id,
+                session_id=session_id,
+                filename=filename,
+                instructions=instructions,
+                status='queued'
+            ))
+            self.db.session.commit()
+
+        self._threads.submit(self._run, job_id, user_id, session_id, filename, data, instructions)
+        return job_id
+
+    def _update(self, job_id, **fields):
+        with self.app.app_context():
+            fields['updated_at'] = datetime.utcnow()
+            self.model.query.filter_by(id=job_id).update(fields)
+            self.db.session.commit()
+
+    def _run(self, job_id, user_id, session_id, filename, data, instructions):
+        try:
+            self._update(job_id, status='extracting')
+            pages = []
+
+            def on_page(result):
+                # A constant-size progress write per page; the text is stored once below
+                pages.append({key: result[key] for key in ('page', 'method', 'seconds')})
+                self._update(job_id, pages_done=len(pages))
+
+            extracted_text = self.extract_fn(filename, data, executor=self._pool(), on_page=on_page)
+            if not extracted_text:
+                self._update(job_id, status='failed', error='No readable text found in file.', pages=json.dumps(pages))
+                return
+
+            self._update(job_id, status='analyzing', extracted_text=extracted_text, pages=json.dumps(pages))
+            ai_response = self.analyze_fn(user_id, session_id, filename, instructions, extracted_text)
+            self._update(job_id, status='done', ai_response=ai_response)
+        except Exception as e:
+            print(f"Upload job {job_id} failed: {e}")
+            self._update(job_id, status='failed', error=str(e)[:500])
+
+    def get(self, job_id, user_id):
+        """Job state as a dict, or None if it does not exist or belongs to someone else."""
+        with self.app.app_context():
+            job = self.model.query.filter_by(id=job_id, user_id=user_id).first()
+            return job_to_dict(job) if job else None
+
+    def shutdown(self):
+        self._threads.shutdown(wait=False)
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False)
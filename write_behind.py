@@ -0,0 +1,129 @@
+"""Bounded write-behind queue that persists items in batches on a background thread."""
+import collections
+import threading
+import time
+
+
+class WriteBehindQueue:
+    """Hands items to `flush_fn` in batches of up to `max_batch`.
+
+    `submit` never blocks: when `max_items` are already waiting it returns
+    False and the caller should write synchronously instead, which keeps
+    memory bounded. `flush_fn` may return the items it could not persist;
+    only those (or the whole batch, if it raised) are retried, up to
+    `max_retries` times, before they are dropped and counted. `close`
+    drains everything still queued.
+    """
+
+    def __init__(self, flush_fn, max_items=10000, max_batch=200, linger=0.05, max_retries=3, name="write-behind"):
+        self.flush_fn = flush_fn
+        self.max_items = max_items
+        self.max_batch = max_batch
+        self.linger = linger
+        self.max_retries = max_retries
+        self.name = name
+        self._items = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._in_flight_since = None
+        self._thread = None
+        self.flushed = 0
+        self.batches = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def submit(self, item):
+        """Queue `item`; returns False when the queue is full or closed."""
+        with self._cond:
+            if self._closed or len(self._items) >= self.max_items:
+                self.rejected += 1
+                return False
+            self._items.append((time.monotonic(), item))
+            self._cond.notify()
+        return True
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._items and not self._closed:
+                self._cond.wait()
+            if not self._items:
+                return None
+        # Let a burst of turns accumulate so they share one storage round-trip
+        if self.linger and not self._closed:
+            time.sleep(self.linger)
+        with self._cond:
+            batch = [self._items.popleft() for _ in range(min(self.max_batch, len(self._items)))]
+            self._in_flight_since = batch[0][0] if batch else None
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            self._flush(batch)
+
+    def _flush(self, batch):
+        items = [item for _, item in batch]
+        flushed = len(items)
+        for attempt in range(self.max_retries + 1):
+            try:
+                items = self.flush_fn(items) or []
+            except Exception as e:
+                print(f"{self.name} flush error (attempt {attempt + 1}): {e}")
+            else:
+                if not items:
+                    break
+                print(f"{self.name}: {len(items)} item(s) not persisted (attempt {attempt + 1})")
+            if attempt < self.max_retries:
+                time.sleep(min(2 ** attempt * 0.1, 2.0))
+        else:
+            self.dropped += len(items)
+
+        lag = time.monotonic() - batch[0][0]
+        with self._cond:
+            self._in_flight_since = None
+            self.flushed += flushed
+            self.batches += 1
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self._cond.notify_all()
+
+    def lag(self):
+        """Seconds the oldest not-yet-persisted item has been waiting."""
+        with self._cond:
+            oldest = self._in_flight_since
+            if self._items:
+                oldest = min(oldest, self._items[0][0]) if oldest is not None else self._items[0][0]
+        return time.monotonic() - oldest if oldest is not None else 0.0
+
+    def close(self, timeout=10):
+        """Stop accepting items and wait for the queue to drain."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        elif self._items:
+            # Never started: flush synchronously so nothing is lost
+            while self._items:
+                self._flush([self._items.popleft() for _ in range(min(self.max_batch, len(self._items)))])
+
+    def stats(self):
+        return {
+            "pending": len(self._items),
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "durability_lag_seconds": self.lag(),
+            "last_flush_lag_seconds": self.last_lag,
+            "max_flush_lag_seconds": self.max_lag
+        }